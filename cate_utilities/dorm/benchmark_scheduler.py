@@ -0,0 +1,273 @@
+"""
+Benchmarks for the dorm scheduler.
+
+Times make_dates, expanding an AcademicCalendar's dates and each phase of
+Dorm.make_schedule (from its ScheduleStats) on synthetic dorms of different
+sizes and on the six real dorms from run_dorm_scheduler.py, and writes the
+results as JSON so runs can be compared.  Every schedule is checked with
+schedule_validator; one that breaks a hard rule is 'invalid'.
+
+usage:
+    python benchmark_scheduler.py [--output results.json] [--compare old.json]
+                                  [--cases small,year] [--timeout 60]
+                                  [--weekday-solver flow] [--hospital-method matching]
+                                  [--engine search] [--optimize-time 0.5]
+"""
+import argparse, datetime, json, multiprocessing, platform, random, sys, StringIO
+from timeit import default_timer as timer
+from dorm_scheduler import *
+from schedule_validator import validate_schedule
+
+#name -> synthetic dorm parameters (see make_synthetic_dorm)
+SYNTHETIC_CASES = [
+    ('term', dict(terms = 1, num_faculty = 5)),
+    ('year', dict(terms = 3, num_faculty = 5, family_pairs = 1)),
+    ('year_busy', dict(terms = 3, num_faculty = 8, family_pairs = 2, unavailable_density = 0.05)),
+    ('two_years', dict(terms = 6, num_faculty = 10, family_pairs = 2, unavailable_density = 0.02)),
+    ('four_years', dict(terms = 12, num_faculty = 20, num_hospital = 6, family_pairs = 4,
+                        unavailable_density = 0.02)),
+]
+
+def synthetic_calendar(terms, start = datetime.date(2014, 8, 25), term_weeks = 12, break_weeks = 1):
+    """
+    returns:
+        an AcademicCalendar of terms back-to-back terms of term_weeks weeks
+        with break_weeks between them and a Thursday-Sunday vacation in the
+        middle of each
+    """
+    fmt = lambda date: date.strftime('%m/%d/%Y')
+    term_dates = []
+    vacation_list = []
+    for i in range(terms):
+        term_start = start + datetime.timedelta(weeks = i*(term_weeks + break_weeks))
+        term_dates.append((term_start, term_start + datetime.timedelta(weeks = term_weeks, days = -1)))
+        midterm = term_start + datetime.timedelta(weeks = term_weeks//2)
+        thursday = midterm + datetime.timedelta(days = (DAY_NAMES.index('Thursday') - midterm.weekday()) % 7)
+        vacation_list.append('%s-%s' % (fmt(thursday), fmt(thursday + datetime.timedelta(days = 3))))
+    head_dates = [start + datetime.timedelta(days = 1)]
+    for term_start, term_end in term_dates:
+        head_dates.extend([term_start, term_end])
+    return AcademicCalendar(term_dates, vacation_list, head_dates)
+
+def make_dates_arguments(calendar):
+    """
+    returns:
+        (start_date, end_date, skip_dates) strings for which make_dates gives
+        the same dates as calendar.dates(): the days between terms and the
+        vacations are skip ranges
+    """
+    fmt = lambda ordinal: datetime.date.fromordinal(ordinal).strftime('%m/%d/%Y')
+    skip = [(last.toordinal() + 1, next_first.toordinal() - 1)
+            for (first, last), (next_first, next_last) in zip(calendar.terms, calendar.terms[1:])
+            if next_first.toordinal() - last.toordinal() > 1]
+    skip_dates = ['%s-%s' % (fmt(first), fmt(last)) for first, last in sorted(skip + calendar.vacations)]
+    return (calendar.start_date().strftime('%m/%d/%Y'), calendar.end_date().strftime('%m/%d/%Y'), skip_dates)
+
+def make_synthetic_dorm(name = 'Synthetic', terms = 3, num_faculty = 5, residential_fraction = 0.5,
+                        num_hospital = 2, family_pairs = 0, unavailable_density = 0.0,
+                        hospital_weeks = 5, seed = 0):
+    """
+    expects:
+        terms is the calendar length in terms (3 a year)
+        num_faculty dorm faculty: one head, residential_fraction residential, the rest adjuncts
+        num_hospital hospital-only faculty, family_pairs of whom are married to dorm faculty
+        unavailable_density is the fraction of days each non-head faculty member is unavailable
+        hospital_weeks of hospital runs at the start of the second term (or the first)
+    returns:
+        (dorm, AcademicCalendar)
+    """
+    generator = random.Random(seed)
+    calendar = synthetic_calendar(terms)
+    dorm = Dorm(name, calendar)
+    num_residential = int(round((num_faculty - 1)*residential_fraction))
+    dorm_names = ['F%02d' % i for i in range(num_faculty)]
+    hospital_names = ['H%02d' % i for i in range(num_hospital)]
+    family = {}
+    for i in range(min(family_pairs, num_faculty, num_hospital)):
+        family[dorm_names[i]] = hospital_names[i]
+        family[hospital_names[i]] = dorm_names[i]
+    for i, fac_name in enumerate(dorm_names):
+        if i == 0:
+            role = 'head'
+        elif i <= num_residential:
+            role = 'residential'
+        else:
+            role = 'adjunct'
+        dorm.add_faculty(fac_name, role, family = family.get(fac_name))
+    for fac_name in hospital_names:
+        dorm.add_faculty(fac_name, 'hospital', family = family.get(fac_name))
+
+    dates = sorted(dorm.on_duty)
+    for fac in dorm.faculty[1:]:
+        fac.set_unavailable_dates(generator.sample(dates, int(unavailable_density*len(dates))))
+    if num_hospital:
+        first = (dorm.trimester_breaks or dates)[0] + datetime.timedelta(days = 1)
+        last = min(first + datetime.timedelta(weeks = hospital_weeks), dates[-1])
+        dorm.set_hospital_run_dates(first, last)
+    return dorm, calendar
+
+def reference_dorms():
+    #the real dorm configurations, set up exactly as run_dorm_scheduler.py does
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        import run_dorm_scheduler
+    finally:
+        sys.stdout = stdout
+    return run_dorm_scheduler.dorms
+
+def time_schedule(dorm, seed = 0, **schedule_options):
+    """
+    runs make_schedule with stats on, so whatever phases the options run are
+    timed (engine = 'search', optimize_time and validate included)
+    returns:
+        its ScheduleStats.as_dict()
+    """
+    random.seed(seed)
+    return dorm.make_schedule(stats = True, **schedule_options).as_dict()
+
+def best_time(function, repeat = 5):
+    #best of repeat calls, in seconds, and the last result
+    best = None
+    for i in range(repeat):
+        start = timer()
+        result = function()
+        elapsed = timer() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def time_make_dates(calendar, repeat = 5):
+    #make_dates over the calendar's span with its breaks and vacations skipped
+    start_date, end_date, skip_dates = make_dates_arguments(calendar)
+    best, dates = best_time(lambda: make_dates(start_date, end_date, skip_dates), repeat)
+    return best, len(dates)
+
+def time_calendar_dates(calendar, repeat = 5):
+    #expanding calendar.dates() (the AcademicCalendar path to the same dates)
+    best, dates = best_time(lambda: list(calendar.dates()), repeat)
+    return best, len(dates)
+
+def run_case(case):
+    """
+    expects:
+        case is a (name, kind, parameters, options) tuple; kind is 'synthetic' or 'reference'
+    returns:
+        a JSON-ready dict of the case's timings; failures are recorded, not raised
+    """
+    name, kind, parameters, options = case
+    record = {'name': name, 'kind': kind, 'parameters': parameters}
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        try:
+            if kind == 'synthetic':
+                start = timer()
+                dorm, calendar = make_synthetic_dorm(name, **parameters)
+                record['setup'] = timer() - start
+                record['make_dates'], record['num_dates'] = time_make_dates(calendar)
+                record['calendar_dates'], num_dates = time_calendar_dates(calendar)
+                if num_dates != record['num_dates']:
+                    raise ValueError('calendar.dates() and make_dates disagree', num_dates, record['num_dates'])
+            else:
+                dorm = [dorm for dorm in reference_dorms() if dorm.name == parameters['dorm']][0]
+            record['num_faculty'] = len(dorm.faculty)
+            record['num_hospital_dates'] = len(dorm.h1)
+            stats = time_schedule(dorm, **options)
+            record['phases'] = stats['phase_times']
+            record['counters'] = stats['counters']
+            record['total'] = stats['total_time']
+            #check the result, timed apart from the phases
+            start = timer()
+            report = validate_schedule(dorm)
+            record['validate'] = timer() - start
+            record['violations'] = report.counts()
+            record['soft'] = report.soft
+            record['status'] = 'ok' if report.valid() else 'invalid'
+        except (Exception, SystemExit) as e:
+            record['status'] = 'error'
+            record['error'] = '%s: %s' % (type(e).__name__, e)
+    finally:
+        sys.stdout = stdout
+    return record
+
+def run_cases(cases, timeout = 60):
+    #each case gets its own worker so a hung phase is cut off after timeout seconds
+    records = []
+    for case in cases:
+        pool = multiprocessing.Pool(1)
+        try:
+            records.append(pool.apply_async(run_case, (case,)).get(timeout))
+        except multiprocessing.TimeoutError:
+            records.append({'name': case[0], 'kind': case[1], 'parameters': case[2],
+                            'status': 'timeout', 'timeout': timeout})
+        finally:
+            pool.terminate()
+            pool.join()
+        record = records[-1]
+        print '%-16s %-8s %s' % (record['name'], record['status'],
+                                 '%.4fs' % record['total'] if 'total' in record else record.get('error', ''))
+    return records
+
+def compare(records, old_records, tolerance = 1.5, floor = 0.005):
+    """
+    returns:
+        a list of (case, phase, old seconds, new seconds) for phases that got
+        more than tolerance times slower (ignoring anything under floor seconds)
+    """
+    old = dict([(record['name'], record) for record in old_records])
+    regressions = []
+    for record in records:
+        previous = old.get(record['name'])
+        if previous == None or 'phases' not in previous or 'phases' not in record:
+            continue
+        for phase in sorted(record['phases']) + ['make_dates', 'calendar_dates', 'validate']:
+            new_time = record.get(phase, record['phases'].get(phase))
+            old_time = previous.get(phase, previous['phases'].get(phase))
+            if new_time != None and old_time != None and new_time > floor and new_time > tolerance*old_time:
+                regressions.append((record['name'], phase, old_time, new_time))
+    return regressions
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Time the dorm scheduler phases.')
+    parser.add_argument('--output', default = 'benchmark_results.json')
+    parser.add_argument('--compare', help = 'earlier results file to check for regressions')
+    parser.add_argument('--tolerance', type = float, default = 1.5)
+    parser.add_argument('--cases', help = 'comma-separated case names (default: all)')
+    parser.add_argument('--timeout', type = float, default = 60)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--weekday-solver', default = 'greedy')
+    parser.add_argument('--hospital-method', default = 'rotation')
+    parser.add_argument('--engine', default = 'phases')
+    parser.add_argument('--optimize-time', type = float)
+    args = parser.parse_args(argv)
+
+    options = {'seed': args.seed, 'weekday_solver': args.weekday_solver,
+               'hospital_method': args.hospital_method, 'engine': args.engine,
+               'optimize_time': args.optimize_time}
+    cases = [(name, 'synthetic', parameters, options) for name, parameters in SYNTHETIC_CASES]
+    cases += [('ref_' + dorm.name, 'reference', {'dorm': dorm.name}, options) for dorm in reference_dorms()]
+    if args.cases:
+        wanted = args.cases.split(',')
+        cases = [case for case in cases if case[0] in wanted]
+
+    records = run_cases(cases, args.timeout)
+    results = {'created': datetime.datetime.now().isoformat(),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'options': options,
+               'cases': records}
+    with open(args.output, 'w') as outfile:
+        json.dump(results, outfile, indent = 1, sort_keys = True)
+
+    if args.compare:
+        with open(args.compare) as infile:
+            regressions = compare(records, json.load(infile)['cases'], args.tolerance)
+        for name, phase, old_time, new_time in regressions:
+            print 'REGRESSION %s %s: %.4fs -> %.4fs' % (name, phase, old_time, new_time)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
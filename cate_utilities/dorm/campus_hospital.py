@@ -0,0 +1,170 @@
+import collections, datetime
+from dorm_scheduler import match_slots, conflict_sets, family_groups, hospital_run_bias
+
+class CampusHospitalPool():
+    """
+    Assigns the hospital runs of several dorms from one campus-wide pool
+    instead of each dorm's own hr_faculty.  Anyone on any dorm's hr_faculty
+    can take any dorm's open H1 or H2 runs, and these rules hold campus-wide:
+        - no one takes a run while unavailable, or on a day they or their
+          family have dorm duty or another run
+        - no one has H1 on consecutive days
+    Everyone's share of H1 is the campus total over the pool size, likewise
+    H2; hospital-only faculty, then adjuncts, take the odd extra run.  People
+    cover their own dorm's runs where they can and are guests (Dorm.add_guest)
+    elsewhere.  Runs that are already filled are kept.
+
+    Each run type is one matching of people to dates (a date takes as many
+    people as it has open runs, at most one per family).  H1 runs it puts on
+    consecutive days are swapped apart, which keeps everyone's count; only
+    those no swap can fix are cut from the graph before solving again.
+
+    usage:
+        for dorm in dorms:
+            dorm.make_schedule(hospital_method = None)
+        CampusHospitalPool(dorms).solve()
+    """
+    def __init__(self, dorms):
+        self.dorms = dorms
+        #name -> Faculty and name -> home dorm, in roster order
+        self.fac = collections.OrderedDict()
+        self.home = {}
+        for dorm in dorms:
+            for fac in dorm.hr_faculty:
+                if fac.name in self.fac:
+                    raise ValueError('CampusHospitalPool:  %s is in more than one dorm' % fac.name)
+                self.fac[fac.name] = fac
+                self.home[fac.name] = dorm
+
+        self.conflicts = conflict_sets(self.fac.values())
+        #family key for match_slots: the first name of each connected family
+        self.family = family_groups(list(self.fac), self.conflicts)
+
+        #date -> everyone with dorm duty or a run that day
+        self.busy = collections.defaultdict(set)
+        for dorm in dorms:
+            for runs in [dorm.on_duty, dorm.h1, dorm.h2]:
+                for date, name in runs.items():
+                    if name != None:
+                        self.busy[date].add(name)
+
+    def solve(self):
+        """
+        fills every open H1 and H2 run of every dorm
+        returns:
+            the number of runs filled
+        raises InfeasibleScheduleError if some run can't be filled
+        """
+        if not self.fac:
+            return 0
+        filled = self._solve_runs('h1', hospital_run_bias(self.fac.values(), 'h1'))
+        return filled + self._solve_runs('h2', hospital_run_bias(self.fac.values(), 'h2'))
+
+    def _solve_runs(self, h, bias):
+        one_day = datetime.timedelta(days = 1)
+        names = list(self.fac)
+        open_runs = collections.defaultdict(list)
+        total = 0
+        for dorm in self.dorms:
+            runs = dorm.h1 if h == 'h1' else dorm.h2
+            total += len(runs)
+            for date in runs:
+                if runs[date] == None:
+                    open_runs[date].append(dorm)
+        dates = sorted(open_runs)
+        if not dates:
+            return 0
+        capacity = dict([(date, len(open_runs[date])) for date in dates])
+        shares = dict([(name, float(total)/len(names)) for name in names])
+        fixed = dict([(name, fac.get_duty_count(h)) for name, fac in self.fac.items()])
+        #filled H1 runs, for the consecutive-day rule
+        h1_dates = dict([(name, set(fac.get_duty_list('h1'))) for name, fac in self.fac.items()])
+
+        forbidden = set()
+        def allowed(name, date):
+            if (name, date) in forbidden:
+                return False
+            if not self.fac[name].is_available(date) or self.conflicts[name] & self.busy[date]:
+                return False
+            return h != 'h1' or not (date - one_day in h1_dates[name] or date + one_day in h1_dates[name])
+        while True:
+            assignment = match_slots(dates, names, allowed, shares, fixed, bias, capacity, self.family)
+            if h != 'h1':
+                break
+            cuts = self._separate(assignment, allowed, h1_dates)
+            if not cuts:
+                break
+            forbidden.update(cuts)
+
+        for date in dates:
+            self._place(h, date, assignment[date], open_runs[date])
+        return sum(capacity.values())
+
+    def _separate(self, assignment, allowed, h1_dates):
+        """
+        swaps runs between people until no one has two on consecutive days
+        returns:
+            the (name, date) runs that couldn't be swapped away
+        """
+        one_day = datetime.timedelta(days = 1)
+        taken = collections.defaultdict(set)
+        for name, fixed_dates in h1_dates.items():
+            taken[name].update(fixed_dates)
+        for date, names in assignment.items():
+            for name in names:
+                taken[name].add(date)
+
+        def fits(name, date, leaving, other):
+            #can name move from leaving to date, which other is giving up?
+            if name in assignment[date] or not allowed(name, date):
+                return False
+            if self.family.get(name) != None:
+                for member in assignment[date]:
+                    if member != other and self.family.get(member) == self.family[name]:
+                        return False
+            for day in [date - one_day, date + one_day]:
+                if day in taken[name] and day != leaving:
+                    return False
+            return True
+
+        stuck = []
+        for date in sorted(assignment):
+            for name in list(assignment[date]):
+                if date - one_day not in taken[name]:
+                    continue
+                for other_date in sorted(assignment):
+                    other = [other for other in assignment[other_date]
+                             if other_date != date and other != name
+                             and fits(name, other_date, date, other) and fits(other, date, other_date, name)]
+                    if other:
+                        other = other[0]
+                        assignment[date][assignment[date].index(name)] = other
+                        assignment[other_date][assignment[other_date].index(other)] = name
+                        taken[name].remove(date)
+                        taken[name].add(other_date)
+                        taken[other].remove(other_date)
+                        taken[other].add(date)
+                        break
+                else:
+                    stuck.append((name, date))
+        return stuck
+
+    def _place(self, h, date, names, dorms):
+        #everyone is free that day, so only home dorms matter: fill those first
+        names = list(names)
+        placed = {}
+        for dorm in dorms:
+            for name in names:
+                if self.home[name] is dorm:
+                    placed[dorm] = name
+                    names.remove(name)
+                    break
+        for dorm in dorms:
+            if dorm not in placed:
+                placed[dorm] = names.pop(0)
+        for dorm in dorms:
+            name = placed[dorm]
+            if self.home[name] is not dorm:
+                dorm.add_guest(self.fac[name])
+            dorm.set_hospital_run(h, date, name)
+            self.busy[date].add(name)
@@ -0,0 +1,167 @@
+import datetime, hashlib, json, os, zlib
+
+#bump when the entry format changes
+CACHE_VERSION = 1
+#schedules are only reused by the same scheduler code: every module the
+#make_schedule engines, solvers and validate option run
+SCHEDULER_MODULES = ['dorm_scheduler', 'schedule_search', 'min_cost_flow', 'schedule_optimizer',
+                     'schedule_validator']
+_code_version = []
+
+def code_version():
+    #hash of the scheduler source, computed once per process
+    if not _code_version:
+        digest = hashlib.sha1()
+        for module in SCHEDULER_MODULES:
+            path = os.path.splitext(__import__(module).__file__)[0] + '.py'
+            with open(path, 'rb') as infile:
+                digest.update(infile.read())
+        _code_version.append(digest.hexdigest())
+    return _code_version[0]
+
+def dorm_inputs(dorm, seed = None, schedule_options = {}):
+    """
+    returns:
+        a JSON-ready description of everything a dorm's schedule depends on:
+        calendar, faculty (roles, loads, families, unavailability), weekday
+        presets, rule levels, pre-assigned duties, hospital run dates, seed,
+        the make_schedule options and the scheduler code itself
+    """
+    calendar = dorm.calendar
+    faculty = []
+    for fac in dorm.hr_faculty:
+        availability = fac.availability
+        faculty.append([fac.name, fac.role, fac.load, fac.family,
+                        availability.unavailable_ordinals(), availability.dow_mask])
+    presets = [[i, sorted(dorm.weekday_presets[i].items())] for i in sorted(dorm.weekday_presets)]
+    return {'version': CACHE_VERSION,
+            'code': code_version(),
+            'name': dorm.name,
+            'calendar': [list(calendar.ordinals),
+                         [i for i, scheduled in enumerate(calendar.scheduled) if scheduled],
+                         [date.toordinal() for date in dorm.trimester_breaks],
+                         [date.toordinal() for date in dorm.head_dates]],
+            'duty_window': dorm.duty_window,
+            'faculty': faculty,
+            'weekday_presets': presets,
+            'rule_levels': sorted(dorm.rule_levels.items()),
+            'state': pack_state(dorm.snapshot()),
+            'seed': seed,
+            'options': sorted(schedule_options.items())}
+
+def dorm_key(dorm, seed = None, schedule_options = {}):
+    #stable content hash of dorm_inputs
+    text = json.dumps(dorm_inputs(dorm, seed, schedule_options), sort_keys = True, separators = (',', ':'))
+    return hashlib.sha1(text).hexdigest()
+
+def pack_state(state):
+    """
+    expects:
+        state is a Dorm.snapshot() (on_duty, h1, h2)
+    returns:
+        a JSON-ready dict: a name table, and for each dict the first ordinal,
+        the gaps between dates and the name index on each date (-1 for None)
+    """
+    names = sorted(set([name for runs in state for name in runs.values() if name != None]))
+    index = dict([(name, i) for i, name in enumerate(names)])
+    packed = {'names': names}
+    for key, runs in zip(['on_duty', 'h1', 'h2'], state):
+        ordinals = sorted([date.toordinal() for date in runs])
+        gaps = [b - a for a, b in zip(ordinals, ordinals[1:])]
+        who = [index.get(runs[datetime.date.fromordinal(ordinal)], -1) for ordinal in ordinals]
+        packed[key] = [ordinals[0] if ordinals else None, gaps, who]
+    return packed
+
+def unpack_state(packed):
+    #inverse of pack_state
+    names = packed['names']
+    state = []
+    for key in ['on_duty', 'h1', 'h2']:
+        first, gaps, who = packed[key]
+        runs = {}
+        ordinal = first
+        for i, name_index in enumerate(who):
+            if i > 0:
+                ordinal += gaps[i - 1]
+            runs[datetime.date.fromordinal(ordinal)] = names[name_index] if name_index >= 0 else None
+        state.append(runs)
+    return tuple(state)
+
+class ScheduleCache():
+    """
+    On-disk cache of finished schedules, keyed by dorm_key, so unchanged
+    dorms don't have to be scheduled again.  Each entry is one file of
+    zlib-compressed JSON (see pack_state).  The least recently used entries
+    are deleted once the directory holds more than max_bytes.
+
+    usage:
+        cache = ScheduleCache('schedule_cache')
+        key = dorm_key(dorm, seed)
+        if not cache.load(key, dorm):
+            dorm.make_schedule()
+            cache.store(key, dorm)
+    """
+    def __init__(self, directory, max_bytes = 10*2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json.z')
+
+    def get(self, key):
+        """
+        returns:
+            the cached (on_duty, h1, h2) for key, or None
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as infile:
+                state = unpack_state(json.loads(zlib.decompress(infile.read())))
+        except (IOError, OSError, ValueError, zlib.error):
+            self.misses += 1
+            return None
+        #mark it recently used
+        os.utime(path, None)
+        self.hits += 1
+        return state
+
+    def put(self, key, state):
+        data = zlib.compress(json.dumps(pack_state(state), separators = (',', ':')), 9)
+        path = self._path(key)
+        #write then rename, so a reader never sees half a file
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'wb') as outfile:
+            outfile.write(data)
+        os.rename(temp_path, path)
+        self.evict()
+
+    def load(self, key, dorm):
+        #restores a cached schedule into dorm; returns False on a miss
+        state = self.get(key)
+        if state == None:
+            return False
+        dorm.restore(state)
+        return True
+
+    def store(self, key, dorm):
+        self.put(key, dorm.snapshot())
+
+    def evict(self):
+        #drop least recently used entries until the cache fits in max_bytes
+        entries = []
+        total = 0
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.json.z'):
+                path = os.path.join(self.directory, filename)
+                info = os.stat(path)
+                entries.append((info.st_mtime, path, info.st_size))
+                total += info.st_size
+        entries.sort()
+        while total > self.max_bytes and entries:
+            mtime, path, size = entries.pop(0)
+            os.remove(path)
+            total -= size
@@ -1,4 +1,66 @@
-import datetime, random, csv, math, collections, sys
+import datetime, random, csv, math, collections, sys, bisect, heapq
+from array import array
+from timeit import default_timer as timer
+from min_cost_flow import MinCostFlow
+
+class InfeasibleScheduleError(Exception):
+    #raised when the constraints leave no valid assignment
+    pass
+
+#what a proposed change would do (see Dorm.check_changes); it is allowed when violations is empty
+SwapImpact = collections.namedtuple('SwapImpact', ['changes', 'violations', 'load_change', 'cost_change'])
+
+def parse_date(date):
+    #accepts a 'mm/dd/yyyy' string or a datetime.date
+    if isinstance(date, datetime.date):
+        return date
+    return datetime.datetime.strptime(date.strip(), '%m/%d/%Y').date()
+
+def merge_skip_dates(skip_dates):
+    """
+    expects:
+        skip_dates is a list of 'mm/dd/yyyy' strings and/or 'mm/dd/yyyy - mm/dd/yyyy'
+    returns:
+        a sorted list of disjoint (first, last) ordinal pairs covering the skipped days
+    """
+    intervals = []
+    for skip_date in skip_dates:
+        if '-' in skip_date:
+            i = skip_date.index('-')
+            first = parse_date(skip_date[:i]).toordinal()
+            last = parse_date(skip_date[i+1:]).toordinal()
+        else:
+            first = last = parse_date(skip_date).toordinal()
+        #a backwards range skips nothing
+        if first <= last:
+            intervals.append((first, last))
+    intervals.sort()
+    merged = []
+    for first, last in intervals:
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
+
+def iter_dates(start_date, end_date, skip_dates = []):
+    """
+    generator version of make_dates: yields the datetime.date objects one at a time
+    """
+    ordinal = parse_date(start_date).toordinal()
+    end = parse_date(end_date).toordinal()
+    for first, last in merge_skip_dates(skip_dates):
+        while ordinal < first and ordinal <= end:
+            yield datetime.date.fromordinal(ordinal)
+            ordinal += 1
+        if ordinal > end:
+            return
+        if last >= ordinal:
+            ordinal = last + 1
+    while ordinal <= end:
+        yield datetime.date.fromordinal(ordinal)
+        ordinal += 1
 
 def make_dates(start_date, end_date, skip_dates = []):
     """
@@ -9,26 +71,928 @@ def make_dates(start_date, end_date, skip_dates = []):
     returns:
         a list of datetime.date objects
     """
-    start_date = datetime.datetime.strptime(start_date, '%m/%d/%Y').date()
-    end_date = datetime.datetime.strptime(end_date, '%m/%d/%Y').date()
-    dates = []
-    date = start_date
-    while date <= end_date:
-        dates.append(date)
-        date += datetime.timedelta(days=1)
+    return list(iter_dates(start_date, end_date, skip_dates))#make a list of dates
 
-    for skip_date in skip_dates:
-        if '-' in skip_date:
-            i = skip_date.index('-')
-            mydates = make_dates(skip_date[:i].strip(), skip_date[i+1:].strip())
-            for date in mydates:
-                if date in dates:
-                    dates.remove(date)
+class AcademicCalendar():
+    """
+    The terms a dorm is scheduled over: any number of terms in a row (across
+    as many years as needed), the vacations inside them and the head dates.
+    Days between one term and the next are not scheduled.  Nothing is
+    expanded until dates() is walked, so planning years ahead costs nothing
+    up front, and select() gives part of a calendar to schedule on its own.
+    expects:
+        terms is a list of (first day, last day) pairs, 'mm/dd/yyyy' strings or dates
+        vacation_list is a list of skip dates/ranges, as for make_dates
+        head_dates are the dates the dorm head is always on duty
+
+    usage:
+        year = AcademicCalendar([('8/25/2014', '11/21/2014'), ('11/22/2014', '2/27/2015'),
+                                 ('2/28/2015', '5/29/2015')], vacation_list, head_dates)
+        dorm = Dorm('CHW', year.repeat(3))
+    """
+    def __init__(self, terms, vacation_list = [], head_dates = []):
+        self.terms = sorted([(parse_date(first), parse_date(last)) for first, last in terms])
+        if not self.terms:
+            raise ValueError('AcademicCalendar:  no terms')
+        for first, last in self.terms:
+            if first > last:
+                raise ValueError('AcademicCalendar:  term ends before it starts', first, last)
+        for (first, last), (next_first, next_last) in zip(self.terms, self.terms[1:]):
+            if next_first <= last:
+                raise ValueError('AcademicCalendar:  terms overlap', last, next_first)
+        #sorted disjoint (first, last) ordinal pairs
+        self.vacations = merge_skip_dates(vacation_list)
+        self.head_dates = sorted(set([parse_date(date) for date in head_dates]))
+        self._starts = [first.toordinal() for first, last in self.terms]
+
+    def __len__(self):
+        return len(self.terms)
+
+    def start_date(self):
+        return self.terms[0][0]
+
+    def end_date(self):
+        return self.terms[-1][1]
+
+    def term_breaks(self):
+        #the first day of every term after the first (Dorm.trimester_breaks)
+        return [first for first, last in self.terms[1:]]
+
+    def term_index(self, date):
+        #the term date falls in (or the last one before it), by bisection over the term starts
+        return max(bisect.bisect_right(self._starts, date.toordinal()) - 1, 0)
+
+    def dates(self):
+        #yields the scheduled days in order, skipping vacations
+        vacations = self.vacations
+        v = 0
+        for first, last in self.terms:
+            ordinal, end = first.toordinal(), last.toordinal()
+            while ordinal <= end:
+                while v < len(vacations) and vacations[v][1] < ordinal:
+                    v += 1
+                if v < len(vacations) and vacations[v][0] <= ordinal:
+                    ordinal = vacations[v][1] + 1
+                    continue
+                yield datetime.date.fromordinal(ordinal)
+                ordinal += 1
+
+    def _copy(self, terms, vacations, head_dates):
+        calendar = AcademicCalendar(terms, [], head_dates)
+        calendar.vacations = vacations
+        return calendar
+
+    def select(self, first_term, last_term = None):
+        """
+        returns:
+            a calendar of terms first_term through last_term (default: just
+            first_term), with the head dates up to the start of the next term
+        """
+        if last_term == None:
+            last_term = first_term
+        if not 0 <= first_term <= last_term < len(self.terms):
+            raise IndexError('AcademicCalendar.select:  no such terms', first_term, last_term)
+        terms = self.terms[first_term:last_term + 1]
+        start = terms[0][0] if first_term > 0 else datetime.date.min
+        end = self.terms[last_term + 1][0] if last_term + 1 < len(self.terms) else datetime.date.max
+        head_dates = [date for date in self.head_dates if start <= date < end]
+        return self._copy(terms, self.vacations, head_dates)
+
+    def shifted(self, days):
+        #the same calendar days later (364 keeps the days of the week)
+        terms = [(first + datetime.timedelta(days = days), last + datetime.timedelta(days = days))
+                 for first, last in self.terms]
+        vacations = [(first + days, last + days) for first, last in self.vacations]
+        head_dates = [date + datetime.timedelta(days = days) for date in self.head_dates]
+        return self._copy(terms, vacations, head_dates)
+
+    def repeat(self, years, days = 364):
+        """
+        returns:
+            years copies of this calendar, each days after the one before, as
+            one calendar (e.g. a one-year calendar planned four years ahead)
+        """
+        copies = [self.shifted(year*days) for year in range(years)]
+        return self._copy([term for copy in copies for term in copy.terms],
+                          [vacation for copy in copies for vacation in copy.vacations],
+                          [date for copy in copies for date in copy.head_dates])
+
+def default_calendar():
+    #the 2014-15 school year: three trimesters
+    vacation_list = ['9/5/2014-9/13/2014', '11/23/2014-11/30/2014',
+                     '12/20/2014-1/4/2015', '3/1/2015-3/14/2015']
+    head_dates = ['8/25/2014', '8/26/2014', '11/22/2014', '12/1/2014', '12/19/2014',
+                  '1/5/2015', '2/28/2015', '3/15/2015', '5/30/2015']
+    terms = [('8/25/2014', '11/21/2014'), ('11/22/2014', '2/27/2015'), ('2/28/2015', '5/29/2015')]
+    return AcademicCalendar(terms, vacation_list, head_dates)
+
+def match_slots(slots, names, allowed, shares, fixed = {}, bias = {}, capacity = None, group = {}):
+    """
+    Assigns one name to every slot by a min-cost flow.
+    expects:
+        slots is a list of hashable slot keys (e.g. dates)
+        names is a list of candidate names
+        allowed(name, slot) is True when name may take slot
+        shares maps each name to the number of slots they should end up with
+        fixed maps names to slots they already hold (counted towards shares)
+        bias maps names to a small per-slot cost used to break ties
+        capacity, if given, maps each slot to how many different names it takes
+        group maps names to a key (e.g. a family); names sharing a key never
+        share a slot
+    returns:
+        a dict of slot -> name minimising the sum of (count - share)**2
+        (slot -> list of names when capacity is given)
+    raises InfeasibleScheduleError if some slot can't be filled
+    """
+    graph = MinCostFlow()
+    source, sink = graph.add_node(), graph.add_node()
+    slot_node = {}
+    needed = 0
+    for slot in slots:
+        slot_node[slot] = graph.add_node()
+        size = 1 if capacity == None else capacity[slot]
+        graph.add_edge(slot_node[slot], sink, size, 0)
+        needed += size
+    edges = []
+    group_node = {}
+    for name in names:
+        choices = [slot for slot in slots if allowed(name, slot)]
+        if not choices:
+            continue
+        name_node = graph.add_node()
+        held = fixed.get(name, 0)
+        for k in range(1, len(choices) + 1):
+            cost = int(round(100*(2*(held + k - shares[name]) - 1))) + bias.get(name, 0)
+            graph.add_edge(source, name_node, 1, cost)
+        for slot in choices:
+            target = slot_node[slot]
+            if name in group:
+                key = (group[name], slot)
+                if key not in group_node:
+                    group_node[key] = graph.add_node()
+                    graph.add_edge(group_node[key], slot_node[slot], 1, 0)
+                target = group_node[key]
+            edges.append((graph.add_edge(name_node, target, 1, 0), slot, name))
+    flow, cost = graph.solve(source, sink, needed)
+    assignment = {}
+    for edge, slot, name in edges:
+        if graph.get_flow(edge):
+            if capacity == None:
+                assignment[slot] = name
+            else:
+                assignment.setdefault(slot, []).append(name)
+    if flow < needed:
+        if capacity == None:
+            missing = [slot for slot in slots if slot not in assignment]
         else:
-            date = datetime.datetime.strptime(skip_date, '%m/%d/%Y').date()
+            missing = [slot for slot in slots if len(assignment.get(slot, [])) < capacity[slot]]
+        raise InfeasibleScheduleError('no one can take %d slot(s), starting with %s' % (needed - flow, missing[0]))
+    return assignment
+
+def conflict_sets(faculty):
+    """
+    returns:
+        name -> the set of people who can't share a date with them: themselves,
+        their family and anyone whose family they are (families off the
+        roster get an entry too)
+    """
+    conflicts = {}
+    for fac in faculty:
+        conflicts.setdefault(fac.name, set([fac.name]))
+        if fac.family != None:
+            conflicts[fac.name].add(fac.family)
+            conflicts.setdefault(fac.family, set([fac.family])).add(fac.name)
+    return conflicts
+
+def family_groups(names, conflicts):
+    #name -> the first of names in their connected family, for match_slots' group;
+    #people with no family are left out
+    family = {}
+    for name in names:
+        if name not in family and len(conflicts[name]) > 1:
+            stack = [name]
+            while stack:
+                member = stack.pop()
+                if member not in family:
+                    family[member] = name
+                    stack.extend(conflicts.get(member, []))
+    return family
+
+def hospital_run_bias(faculty, h):
+    """
+    returns:
+        name -> match_slots bias for h ('h1' or 'h2') runs: hospital-only
+        faculty, then adjuncts, take the odd extra run, and for H2 people
+        with more H1 runs are last in line
+    """
+    rank = {'hospital': 0, 'adjunct': 1}
+    bias = {}
+    for fac in faculty:
+        bias[fac.name] = rank.get(fac.role, 2)
+        if h == 'h2':
+            bias[fac.name] += 3*fac.get_duty_count('h1')
+    return bias
+
+class CalendarIndex():
+    """
+    Precomputed per-day lookup table for a dorm's calendar.
+
+    Every day between the first and last scheduled date gets a row, so the row
+    of a date is just date.toordinal() - self.first.  The parallel columns hold
+    the day of week (date.weekday() numbering), the trimester (from
+    term_index(date), e.g. AcademicCalendar.term_index), and flags for head
+    dates, weekends and scheduled days.
+    self.ordinals is the sorted array of ordinals for the scheduled and head days.
+    """
+    def __init__(self, dates, term_index, head_dates):
+        #dates can be any iterable (e.g. iter_dates); it is only walked once
+        scheduled = [date.toordinal() for date in dates]
+        ordinals = sorted(set(scheduled + [date.toordinal() for date in head_dates]))
+        self.ordinals = array('l', ordinals)
+        self.first = ordinals[0]
+        self.last = ordinals[-1]
+        n = self.last - self.first + 1
+        days = [datetime.date.fromordinal(self.first + i) for i in range(n)]
+        self.dow = array('b', [date.weekday() for date in days])
+        self.trimester = array('b', [term_index(date) for date in days])
+        self.weekend = array('b', [dow in WEEKEND_DOWS for dow in self.dow])
+        self.head = array('b', [0]*n)
+        for date in head_dates:
+            self.head[date.toordinal() - self.first] = 1
+        self.scheduled = array('b', [0]*n)
+        for ordinal in scheduled:
+            self.scheduled[ordinal - self.first] = 1
+
+    def __len__(self):
+        return len(self.dow)
+
+    def __contains__(self, date):
+        return self.first <= date.toordinal() <= self.last
+
+    def row(self, date):
+        i = date.toordinal() - self.first
+        if i < 0 or i >= len(self.dow):
+            raise KeyError('%s is not in the dorm calendar' % date)
+        return i
+
+    def date(self, row):
+        return datetime.date.fromordinal(self.first + row)
+
+    def dates(self):
+        for ordinal in self.ordinals:
+            yield datetime.date.fromordinal(ordinal)
+
+    def scheduled_dates(self):
+        first = self.first
+        for row, scheduled in enumerate(self.scheduled):
+            if scheduled:
+                yield datetime.date.fromordinal(first + row)
+
+    def day_of_week(self, date):
+        return self.dow[self.row(date)]
+
+    def day_name(self, date):
+        return DAY_NAMES[self.dow[self.row(date)]]
+
+    def is_weekend(self, date):
+        return self.weekend[self.row(date)] == 1
+
+    def is_weekday(self, date):
+        return self.weekend[self.row(date)] == 0
+
+    def is_head_date(self, date):
+        return self.head[self.row(date)] == 1
+
+    def get_trimester(self, date):
+        return self.trimester[self.row(date)]
+
+class Availability():
+    """
+    Unavailability of one faculty member: one byte per day (1 = unavailable),
+    indexed by date.toordinal() - self.origin, plus a 7-bit day-of-week mask.
+    The byte array grows to cover any date it is given.
+    """
+    def __init__(self, first, days = 0):
+        self.origin = first
+        self.days = bytearray(days)
+        self.dow_mask = 0
+
+    def _grow(self, first, last):
+        if first < self.origin:
+            self.days[0:0] = bytearray(self.origin - first)
+            self.origin = first
+        end = last - self.origin + 1
+        if end > len(self.days):
+            self.days.extend(bytearray(end - len(self.days)))
+
+    def set_unavailable_range(self, first, last):
+        #first and last are inclusive ordinals
+        if first > last:
+            return
+        self._grow(first, last)
+        self.days[first - self.origin:last - self.origin + 1] = bytearray(b'\x01')*(last - first + 1)
+
+    def set_unavailable_dow(self, dow):
+        self.dow_mask |= 1 << dow
+
+    def is_available(self, ordinal, dow):
+        if self.dow_mask >> dow & 1:
+            return False
+        i = ordinal - self.origin
+        return not (0 <= i < len(self.days) and self.days[i])
+
+    def is_available_dow(self, dow):
+        return not self.dow_mask >> dow & 1
+
+    def unavailable_ordinals(self):
+        return [self.origin + i for i, value in enumerate(self.days) if value]
+
+#AssignmentStore slot values besides faculty ids
+ABSENT, NOBODY = -2, -1
+
+class AssignmentStore():
+    """
+    A dorm's duty assignments in compact form.  Faculty names are interned as
+    small integer ids (self.names[id]), and each duty type ('dorm', 'h1',
+    'h2') is an array('h') of ids indexed by date.toordinal() - self.origin.
+    A slot is ABSENT when the date has no duty of that type and NOBODY when
+    the duty is unassigned.  All columns cover the same days and grow to fit
+    any date given.  view(type) is the dict-like face Dorm.on_duty, h1 and
+    h2 show the rest of the code; counting passes can read column(type).
+    """
+    TYPES = ['dorm', 'h1', 'h2']
+
+    def __init__(self, origin, days = 0):
+        self.origin = origin
+        self.names = []
+        self.ids = {}
+        self.columns = dict([(type, array('h', [ABSENT])*days) for type in self.TYPES])
+        self.sizes = dict([(type, 0) for type in self.TYPES])
+
+    def intern(self, name):
+        if name == None:
+            return NOBODY
+        id = self.ids.get(name)
+        if id == None:
+            id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return id
+
+    def name(self, id):
+        return self.names[id] if id >= 0 else None
+
+    def column(self, type):
+        #the raw id array; index i is the day self.origin + i
+        return self.columns[type]
+
+    def _grow(self, ordinal):
+        if ordinal < self.origin:
+            for column in self.columns.values():
+                column[0:0] = array('h', [ABSENT])*(self.origin - ordinal)
+            self.origin = ordinal
+        end = ordinal - self.origin + 1
+        for column in self.columns.values():
+            if end > len(column):
+                column.extend(array('h', [ABSENT])*(end - len(column)))
+
+    def get_id(self, type, ordinal):
+        i = ordinal - self.origin
+        column = self.columns[type]
+        if 0 <= i < len(column):
+            return column[i]
+        return ABSENT
+
+    def set(self, type, ordinal, name):
+        self._grow(ordinal)
+        column = self.columns[type]
+        i = ordinal - self.origin
+        if column[i] == ABSENT:
+            self.sizes[type] += 1
+        column[i] = self.intern(name)
+
+    def remove(self, type, ordinal):
+        i = ordinal - self.origin
+        column = self.columns[type]
+        if not (0 <= i < len(column)) or column[i] == ABSENT:
+            raise KeyError(datetime.date.fromordinal(ordinal))
+        column[i] = ABSENT
+        self.sizes[type] -= 1
+
+    def view(self, type):
+        return DutyView(self, type)
+
+    def dow_totals(self, type):
+        #number of type duty days on each day of week (date.weekday() numbering)
+        totals = [0]*7
+        #ordinal 1 was a Monday
+        dow = (self.origin + 6) % 7
+        for id in self.columns[type]:
+            if id != ABSENT:
+                totals[dow] += 1
+            dow = dow + 1 if dow < 6 else 0
+        return totals
+
+class DutyView(collections.MutableMapping):
+    """
+    date -> name (or None) mapping over one AssignmentStore column, so code
+    written for the old dicts keeps working.  Iteration is in date order.
+    """
+    def __init__(self, store, type):
+        self.store = store
+        self.type = type
+
+    def __len__(self):
+        return self.store.sizes[self.type]
+
+    def __contains__(self, date):
+        return self.store.get_id(self.type, date.toordinal()) != ABSENT
+
+    def __getitem__(self, date):
+        id = self.store.get_id(self.type, date.toordinal())
+        if id == ABSENT:
+            raise KeyError(date)
+        return self.store.names[id] if id >= 0 else None
+
+    def get(self, date, default = None):
+        id = self.store.get_id(self.type, date.toordinal())
+        if id == ABSENT:
+            return default
+        return self.store.names[id] if id >= 0 else None
+
+    def __setitem__(self, date, name):
+        self.store.set(self.type, date.toordinal(), name)
+
+    def __delitem__(self, date):
+        self.store.remove(self.type, date.toordinal())
+
+    def __iter__(self):
+        origin = self.store.origin
+        for i, id in enumerate(self.store.columns[self.type]):
+            if id != ABSENT:
+                yield datetime.date.fromordinal(origin + i)
+
+    def keys(self):
+        return list(self)
+
+    def copy(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.copy())
+
+#who may take a duty: rule -> (duty types it covers, default level).  Hard rules
+#always hold; soft ones may be relaxed (strict = False) while rebalancing
+DUTY_RULES = collections.OrderedDict([
+    ('unavailable', (('dorm', 'h1', 'h2'), 'hard')),
+    ('same_person', (('dorm', 'h1', 'h2'), 'hard')),
+    ('family', (('dorm', 'h1', 'h2'), 'hard')),
+    ('consecutive', (('h1',), 'hard')),
+    ('friday_saturday', (('dorm',), 'hard'))])
+
+class DutyRules():
+    """
+    DUTY_RULES compiled for one dorm:
+        unavailable: no duty while unavailable
+        same_person: no duty alongside one's own dorm duty or other run that day
+        family: no duty alongside a family member's duty that day
+        consecutive: no H1 on consecutive days
+        friday_saturday: no dorm duty on a Friday and the following Saturday
+    Everyone the dorm knows (faculty and guests) and their families are
+    interned in the AssignmentStore, and each duty type's rules become a list
+    of checks over integer ids in the store columns, built once per
+    (type, strict).  levels overrides the default level of any rule.
+    A duty of the same type the person gives up on leaving is ignored by the
+    day-pair rules, for swaps.
+
+    usage:
+        allowed = dorm.duty_rules().predicate('h1')
+        if allowed(name, date): ...
+    """
+    def __init__(self, dorm, levels = {}):
+        for rule, level in levels.items():
+            if rule not in DUTY_RULES or level not in ['hard', 'soft']:
+                raise ValueError('DutyRules:  not a valid rule level', rule, level)
+        self.levels = collections.OrderedDict([(rule, levels.get(rule, level))
+                                               for rule, (types, level) in DUTY_RULES.items()])
+        self.store = dorm.assignments
+        #name -> id for the people who can be checked; id -> availability, family ids
+        self.ids = {}
+        self.availability = {}
+        self.kin = collections.defaultdict(set)
+        for name, fac in dorm.fac_instance.items():
+            id = self.ids[name] = self.store.intern(name)
+            self.availability[id] = fac.availability
+            if fac.family != None:
+                family = self.store.intern(fac.family)
+                self.kin[id].add(family)
+                self.kin[family].add(id)
+        self._checks = {}
+        self._predicates = {}
+
+    def applies(self, rule, type, strict = True):
+        types, level = DUTY_RULES[rule]
+        return type in types and (strict or self.levels[rule] == 'hard')
+
+    def checks(self, type, strict = True):
+        """
+        returns:
+            the list of check(id, i, ordinal, dow, leaving) functions for type
+            duty; each gives (rule, detail) if broken, else None.  i and
+            leaving are store column indexes; detail is the other duty type
+            for same_person and family, the other date for the day-pair rules
+        """
+        key = (type, strict)
+        if key in self._checks:
+            return self._checks[key]
+        store = self.store
+        column = store.columns[type]
+        others = [(other, store.columns[other]) for other in store.TYPES if other != type]
+        availability = self.availability
+        kin = self.kin
+        checks = []
+        if self.applies('unavailable', type, strict):
+            def unavailable(id, i, ordinal, dow, leaving):
+                if not availability[id].is_available(ordinal, dow):
+                    return ('unavailable', None)
+            checks.append(unavailable)
+        for other, other_column in others:
+            #bind other and other_column now, not when called
+            if self.applies('same_person', type, strict):
+                def same_person(id, i, ordinal, dow, leaving, other = other, other_column = other_column):
+                    if 0 <= i < len(other_column) and other_column[i] == id:
+                        return ('same_person', other)
+                checks.append(same_person)
+            if self.applies('family', type, strict):
+                def family(id, i, ordinal, dow, leaving, other = other, other_column = other_column):
+                    if 0 <= i < len(other_column) and other_column[i] in kin[id]:
+                        return ('family', other)
+                checks.append(family)
+        def day_pair(rule, step, dows = None):
+            #rule broken by holding the same duty step days away (only on days of week dows, if given)
+            def check(id, i, ordinal, dow, leaving):
+                j = i + step
+                if (dows == None or dow in dows) and j != leaving and 0 <= j < len(column) and column[j] == id:
+                    return (rule, datetime.date.fromordinal(ordinal + step))
+            return check
+        if self.applies('consecutive', type, strict):
+            checks += [day_pair('consecutive', -1), day_pair('consecutive', 1)]
+        if self.applies('friday_saturday', type, strict):
+            checks += [day_pair('friday_saturday', 1, (FRIDAY,)), day_pair('friday_saturday', -1, (SATURDAY,))]
+        self._checks[key] = checks
+        return checks
+
+    def violations(self, name, type, date, leaving = None, strict = True):
+        #yields the (rule, detail) broken by name taking the type duty on date
+        id = self.ids[name]
+        ordinal = date.toordinal()
+        origin = self.store.origin
+        if leaving != None:
+            leaving = leaving.toordinal() - origin
+        dow = date.weekday()
+        for check in self.checks(type, strict):
+            broken = check(id, ordinal - origin, ordinal, dow, leaving)
+            if broken != None:
+                yield broken
+
+    def predicate(self, type, strict = True):
+        """
+        returns:
+            allowed(name, date, leaving = None), True if name can take the type
+            duty on date under the rules
+        """
+        key = (type, strict)
+        if key not in self._predicates:
+            checks = self.checks(type, strict)
+            ids = self.ids
+            store = self.store
+            def allowed(name, date, leaving = None):
+                id = ids[name]
+                ordinal = date.toordinal()
+                origin = store.origin
+                if leaving != None:
+                    leaving = leaving.toordinal() - origin
+                dow = date.weekday()
+                i = ordinal - origin
+                for check in checks:
+                    if check(id, i, ordinal, dow, leaving) != None:
+                        return False
+                return True
+            self._predicates[key] = allowed
+        return self._predicates[key]
+
+class FenwickTree():
+    """
+    Binary indexed tree over positions 0..n-1 supporting point updates and
+    prefix/range sums in O(log n).
+    """
+    def __init__(self, n):
+        self.n = n
+        self.tree = [0]*(n + 1)
+
+    def add(self, i, delta):
+        i += 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, i):
+        #sum of positions 0..i
+        total = 0
+        i = min(i + 1, self.n)
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def range_sum(self, lo, hi):
+        #sum of positions lo..hi inclusive
+        if hi < lo:
+            return 0
+        if lo <= 0:
+            return self.prefix_sum(hi)
+        return self.prefix_sum(hi) - self.prefix_sum(lo - 1)
+
+class DutyDensity():
+    """
+    Tracks how crowded one faculty member's dorm duties are.  A Fenwick tree
+    over the calendar rows holds the duties, so the number of duties within
+    +/- window days of a date is an O(log n) query.  The window count of each
+    weekday duty is kept in a lazily-invalidated max heap, so the worst day
+    doesn't need a rescan.
+    """
+    def __init__(self, calendar, duty_dates, window = 3):
+        self.calendar = calendar
+        #the faculty member's sorted list of dorm duty dates (shared, not copied)
+        self.duty_dates = duty_dates
+        self.tree = FenwickTree(len(calendar))
+        self.window = window
+        self.counts = {}
+        self.heap = []
+
+    def window_count(self, date, window = None):
+        if window == None:
+            window = self.window
+        row = date.toordinal() - self.calendar.first
+        return self.tree.range_sum(row - window, row + window)
+
+    def _refresh(self, date):
+        #recompute the window count of every duty near date
+        lower = date - datetime.timedelta(days = self.window)
+        upper = date + datetime.timedelta(days = self.window)
+        i = bisect.bisect_left(self.duty_dates, lower)
+        while i < len(self.duty_dates) and self.duty_dates[i] <= upper:
+            test_date = self.duty_dates[i]
+            if not self.calendar.is_weekend(test_date):
+                count = self.window_count(test_date)
+                ordinal = test_date.toordinal()
+                if self.counts.get(ordinal) != count:
+                    self.counts[ordinal] = count
+                    heapq.heappush(self.heap, (-count, -ordinal))
+            i += 1
+        if len(self.heap) > 4*len(self.counts) + 16:
+            self.heap = [(-count, -ordinal) for ordinal, count in self.counts.items()]
+            heapq.heapify(self.heap)
+
+    def add(self, date):
+        #call after date has been inserted into duty_dates
+        self.tree.add(self.calendar.row(date), 1)
+        self._refresh(date)
+
+    def remove(self, date):
+        #call after date has been removed from duty_dates
+        self.tree.add(self.calendar.row(date), -1)
+        self.counts.pop(date.toordinal(), None)
+        self._refresh(date)
+
+    def set_window(self, window):
+        self.window = window
+        self.counts = {}
+        for date in self.duty_dates:
+            if not self.calendar.is_weekend(date):
+                self.counts[date.toordinal()] = self.window_count(date)
+        self.heap = [(-count, -ordinal) for ordinal, count in self.counts.items()]
+        heapq.heapify(self.heap)
+
+    def worst(self, dates):
+        """
+        returns the weekday duty in dates with the most duties around it
+        (the latest one on ties), or None
+        """
+        heap = self.heap
+        set_aside = []
+        worst_day = None
+        while heap:
+            count, ordinal = heap[0]
+            if self.counts.get(-ordinal) != -count:
+                heapq.heappop(heap)
+                continue
+            date = datetime.date.fromordinal(-ordinal)
             if date in dates:
-                dates.remove(date)
-    return dates#make a list of dates
+                worst_day = date
+                break
+            set_aside.append(heapq.heappop(heap))
+        for entry in set_aside:
+            heapq.heappush(heap, entry)
+        return worst_day
+
+class LoadTracker():
+    """
+    Keeps each faculty member's overload (duty count minus their share) for one
+    duty type.  Shares are fixed when the tracker is made; call update() with the
+    names whose duties changed after each reassignment.  The most and least
+    loaded people come off lazily-invalidated heaps in O(log n).
+    """
+    def __init__(self, faculty, duty_type, shares):
+        #shares maps each faculty name to the number of duties they should have
+        self.duty_type = duty_type
+        self.shares = shares
+        self.faculty = {}
+        self.order = {}
+        self.overload = {}
+        self.max_heap = []
+        self.min_heap = []
+        for i, fac in enumerate(faculty):
+            self.faculty[fac.name] = fac
+            self.order[fac.name] = i
+        self.update(*[fac.name for fac in faculty])
+
+    def update(self, *names):
+        for name in names:
+            if name not in self.faculty:
+                continue
+            overload = self.faculty[name].get_duty_count(self.duty_type) - self.shares[name]
+            if self.overload.get(name) == overload:
+                continue
+            self.overload[name] = overload
+            #ties go to the earliest (least loaded) or latest (most loaded) person in the roster
+            heapq.heappush(self.min_heap, (overload, self.order[name], name))
+            heapq.heappush(self.max_heap, (-overload, -self.order[name], name))
+        if len(self.min_heap) > 4*len(self.overload) + 16:
+            self.min_heap = [(overload, self.order[name], name) for name, overload in self.overload.items()]
+            self.max_heap = [(-overload, -self.order[name], name) for name, overload in self.overload.items()]
+            heapq.heapify(self.min_heap)
+            heapq.heapify(self.max_heap)
+
+    def _top(self, heap, sign):
+        while self.overload[heap[0][2]] != sign*heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][2]
+
+    def most_loaded(self):
+        return self._top(self.max_heap, -1)
+
+    def least_loaded(self):
+        return self._top(self.min_heap, 1)
+
+    def load_diff(self):
+        return self.overload[self.most_loaded()] - self.overload[self.least_loaded()]
+
+    def ranked(self):
+        #all names in order of increasing overload
+        return sorted(self.overload, key = lambda name: (self.overload[name], self.order[name]))
+
+class ScheduleStats():
+    """
+    What one make_schedule run did: wall time per phase (seconds) and event
+    counters.  A Dorm fills it in while dorm.stats is set; counters are
+        weekday_redraws: weekdays whose default couldn't take them in assign_weekdays
+        set_on_duty_failures: set_on_duty calls refused for unavailability
+        rebalance_moves: weekday duties moved by rebalance_weekdays
+        hospital_repair_iterations: balancing moves in set_hospital_runs
+        search_nodes: nodes visited by solve_schedule
+        optimizer_moves: moves accepted by optimize_schedule
+    """
+    def __init__(self):
+        self.phase_times = collections.OrderedDict()
+        self.counters = collections.defaultdict(int)
+
+    def count(self, counter, n = 1):
+        self.counters[counter] += n
+
+    def add_time(self, phase, seconds):
+        self.phase_times[phase] = self.phase_times.get(phase, 0.) + seconds
+
+    def total_time(self):
+        return sum(self.phase_times.values())
+
+    def as_dict(self):
+        #plain dicts, for json
+        return {'phase_times': dict(self.phase_times), 'counters': dict(self.counters),
+                'total_time': self.total_time()}
+
+    def report(self):
+        lines = ['%-28s %9.4fs' % (phase, seconds) for phase, seconds in self.phase_times.items()]
+        lines += ['%-28s %9d' % (counter, self.counters[counter]) for counter in sorted(self.counters)]
+        return '\n'.join(lines)
+
+class DutyStatistics():
+    """
+    Duty counts for a finished dorm schedule, worked out in one pass over
+    each AssignmentStore column with per-id count arrays.  self.faculty maps
+    each name on dorm.hr_faculty (roster order) to a dict of
+        total, weekdays, Friday, Saturday: dorm duties
+        H1, H2: hospital runs
+        share, deviation: calculate_shares share and total - share
+                          (None for hospital faculty)
+        trimesters: list of dorm duties in each trimester
+        max_consecutive: longest run of dorm duties on consecutive days
+        min_gap: fewest days between two dorm duties (None with fewer than two)
+    self.unassigned maps each duty type to its number of open duties.
+
+    usage:
+        stats = dorm.duty_statistics()
+        stats.faculty['Jamie']['deviation']
+    """
+    def __init__(self, dorm):
+        store = dorm.assignments
+        calendar = dorm.calendar
+        n = len(store.names)
+        num_trimesters = len(dorm.trimester_breaks) + 1
+        break_ordinals = sorted([date.toordinal() for date in dorm.trimester_breaks])
+        self.unassigned = {}
+
+        total = [0]*n
+        dow_counts = [[0]*7 for id in range(n)]
+        trimesters = [[0]*num_trimesters for id in range(n)]
+        last = [None]*n
+        streak = [0]*n
+        max_consecutive = [0]*n
+        min_gap = [None]*n
+        unassigned = 0
+        origin = store.origin
+        #store index i is calendar row i + offset
+        offset = origin - calendar.first
+        dow = (origin + 6) % 7
+        for i, id in enumerate(store.column('dorm')):
+            if id >= 0:
+                total[id] += 1
+                dow_counts[id][dow] += 1
+                row = i + offset
+                if 0 <= row < len(calendar):
+                    trimester = calendar.trimester[row]
+                else:
+                    trimester = bisect.bisect_right(break_ordinals, origin + i)
+                trimesters[id][trimester] += 1
+                if last[id] != None:
+                    gap = i - last[id]
+                    if min_gap[id] == None or gap < min_gap[id]:
+                        min_gap[id] = gap
+                    streak[id] = streak[id] + 1 if gap == 1 else 1
+                else:
+                    streak[id] = 1
+                if streak[id] > max_consecutive[id]:
+                    max_consecutive[id] = streak[id]
+                last[id] = i
+            elif id == NOBODY:
+                unassigned += 1
+            dow = dow + 1 if dow < 6 else 0
+        self.unassigned['dorm'] = unassigned
+
+        runs = {}
+        for type in ['h1', 'h2']:
+            counts = [0]*n
+            unassigned = 0
+            for id in store.column(type):
+                if id >= 0:
+                    counts[id] += 1
+                elif id == NOBODY:
+                    unassigned += 1
+            runs[type] = counts
+            self.unassigned[type] = unassigned
+
+        share = dorm.calculate_shares() if dorm.faculty else {}
+        self.faculty = collections.OrderedDict()
+        for fac in dorm.hr_faculty:
+            id = store.ids.get(fac.name)
+            if id == None:
+                record = {'total': 0, 'Friday': 0, 'Saturday': 0, 'H1': 0, 'H2': 0,
+                          'trimesters': [0]*num_trimesters, 'max_consecutive': 0, 'min_gap': None}
+            else:
+                record = {'total': total[id], 'Friday': dow_counts[id][FRIDAY],
+                          'Saturday': dow_counts[id][SATURDAY], 'H1': runs['h1'][id], 'H2': runs['h2'][id],
+                          'trimesters': trimesters[id], 'max_consecutive': max_consecutive[id],
+                          'min_gap': min_gap[id]}
+            record['weekdays'] = record['total'] - record['Friday'] - record['Saturday']
+            if fac.load in share:
+                record['share'] = share[fac.load]
+                record['deviation'] = record['total'] - share[fac.load]
+            else:
+                record['share'] = record['deviation'] = None
+            self.faculty[fac.name] = record
+
+    def as_dict(self):
+        #plain dicts, for json
+        return {'faculty': dict(self.faculty), 'unassigned': dict(self.unassigned)}
+
+    def report(self, names = None):
+        #the table get_duty_counts prints, for names (default: everyone)
+        lines = [' '.join(['Name', 'total', 'Weekdays', 'Fridays', 'Saturdays', 'H1', 'H2'])]
+        for name in (self.faculty if names == None else names):
+            record = self.faculty[name]
+            lines.append(' '.join([str(value) for value in [name, record['total'], record['weekdays'],
+                                                             record['Friday'], record['Saturday'],
+                                                             record['H1'], record['H2']]]))
+        return '\n'.join(lines)
 
 class Faculty():
     def __init__(self, name, role, dorm, load = None, family = None):
@@ -49,94 +1013,275 @@ class Faculty():
         else:
             raise ValueError('%s not a valid load' % load)
 
-        self.unavailable_dates = []
-        self.unavailable_dow = []
-        self.on_duty = []
+        self.availability = Availability(dorm.calendar.first, len(dorm.calendar))
+        #every set_unavailable_* call as (first ordinal, last ordinal, None) or (None, None, dow)
+        self.availability_changes = []
+        #sorted duty dates for each duty type, kept in step with the dorm's assignments
+        self.duties = {'dorm': [], 'h1': [], 'h2': []}
+        self.on_duty = self.duties['dorm']
+        #dorm duties on each day of week (date.weekday() numbering)
+        self.dow_counts = [0]*7
         self.dorm = dorm
+        self.density = DutyDensity(dorm.calendar, self.on_duty, dorm.duty_window)
 
-    def get_duty_dates(self, type = 'dorm'):
-        if type.lower() == 'dorm':
-            dates = sorted([date for date in self.dorm.on_duty.keys() if self.dorm.on_duty[date] == self.name])
-        elif type.lower() == 'h1':
-            dates = sorted([date for date in self.dorm.h1.keys() if self.dorm.h1[date] == self.name])
-        elif type.lower() == 'h2':
-            dates = sorted([date for date in self.dorm.h2.keys() if self.dorm.h2[date] == self.name])
-        else:
+    def get_duty_list(self, type = 'dorm'):
+        #the maintained (sorted) list itself -- don't modify it
+        try:
+            return self.duties[type.lower()]
+        except KeyError:
             raise ValueError('Faculty.get_duty_dates:  type not valid', type)
-        return dates
+
+    def get_duty_dates(self, type = 'dorm'):
+        return self.get_duty_list(type)[:]
+
+    def get_duty_count(self, type = 'dorm'):
+        return len(self.get_duty_list(type))
+
+    def add_duty(self, date, type = 'dorm'):
+        dates = self.get_duty_list(type)
+        i = bisect.bisect_left(dates, date)
+        if i == len(dates) or dates[i] != date:
+            dates.insert(i, date)
+            if dates is self.on_duty:
+                self.density.add(date)
+                self.dow_counts[date.weekday()] += 1
+
+    def set_off_duty(self, date, type = 'dorm'):
+        dates = self.get_duty_list(type)
+        i = bisect.bisect_left(dates, date)
+        if i < len(dates) and dates[i] == date:
+            del dates[i]
+            if dates is self.on_duty:
+                self.density.remove(date)
+                self.dow_counts[date.weekday()] -= 1
+
+    @property
+    def unavailable_dates(self):
+        return [datetime.date.fromordinal(ordinal) for ordinal in self.availability.unavailable_ordinals()]
+
+    @property
+    def unavailable_dow(self):
+        return [DAY_NAMES[dow] for dow in range(7) if not self.availability.is_available_dow(dow)]
 
     def set_unavailable_date(self, date):
-        self.unavailable_dates.append(date)
+        self.set_unavailable_range(date, date)
+
+    def set_unavailable_range(self, start_date, end_date):
+        #marks every day from start_date through end_date (dates or 'mm/dd/yyyy' strings)
+        first, last = parse_date(start_date).toordinal(), parse_date(end_date).toordinal()
+        self.availability.set_unavailable_range(first, last)
+        self.availability_changes.append((first, last, None))
+
+    def set_unavailable_dates(self, dates):
+        for date in dates:
+            self.set_unavailable_date(date)
 
     def set_unavailable_dow(self, dow):
-        self.unavailable_dow.append(dow)
+        #dow is a day name ('Monday') or a date.weekday() number
+        if dow in DAY_NAMES:
+            dow = DAY_NAMES.index(dow)
+        self.availability.set_unavailable_dow(dow)
+        self.availability_changes.append((None, None, dow))
+
+    def get_lost_duties(self, since = 0):
+        """
+        returns:
+            the sorted (type, date) duties this person holds on days made
+            unavailable by availability_changes[since:]
+        """
+        lost = set()
+        for first, last, dow in self.availability_changes[since:]:
+            for type, dates in self.duties.items():
+                if dow == None:
+                    lo = bisect.bisect_left(dates, datetime.date.fromordinal(first))
+                    hi = bisect.bisect_right(dates, datetime.date.fromordinal(last))
+                    lost.update([(type, date) for date in dates[lo:hi]])
+                else:
+                    lost.update([(type, date) for date in dates if date.weekday() == dow])
+        return sorted(lost)
+
+    def is_available(self, date):
+        return self.availability.is_available(date.toordinal(), date.weekday())
+
+    def is_available_dow(self, dow):
+        if dow in DAY_NAMES:
+            dow = DAY_NAMES.index(dow)
+        return self.availability.is_available_dow(dow)
 
     def set_on_duty(self, date):
-        if date in self.unavailable_dates or date.strftime('%A') in self.unavailable_dow:
+        if not self.is_available(date):
             raise Exception('Unavailable')
         else:
-            self.on_duty.append(date)
+            self.add_duty(date, 'dorm')
 
-    def get_worst_day(self, dates):
-        worst_count = 0
-        worst_day = None
-        for date in self.get_duty_dates('dorm'):
-            if date not in dates or date.strftime('%A') in weekends:
-                continue
-            lower_date = date - datetime.timedelta(days=3)
-            upper_date = date + datetime.timedelta(days=3)
-            count = 0
-            for test_date in self.on_duty:
-                if lower_date <= test_date <= upper_date:
-                    count += 1
-            if count >= worst_count:
-                worst_count = count
-                worst_day = date
-        return worst_day
+    def get_worst_day(self, dates, window = None):
+        #the weekday duty in dates with the most of this person's duties within +/- window days
+        if window == None:
+            window = self.dorm.duty_window
+        if window != self.density.window:
+            self.density.set_window(window)
+        return self.density.worst(dates)
 
 
 class Dorm():
-    def __init__(self, name):
+    def __init__(self, name, calendar = None):
 
         self.name = name
         #define a list of faculty instances
         self.faculty = []
-        #define a dictionary that connects dates to names (this would be better as instances)
+        #date -> name mappings for dorm duty and hospital runs, backed by an
+        #AssignmentStore (set up with the calendar in set_calendar)
+        self.assignments = None
         self.on_duty = {}
+        self.h1 = {}
+        self.h2 = {}
         #define a dictionary to connect names to Faculty instances
         self.fac_instance = {}
 
         #define a roster of faculty responsible for hospital runs
         self.hr_faculty = []
-        self.h1 = {}
-        self.h2 = {}
 
+        #how many days either side of a duty count as crowding it (see Faculty.get_worst_day)
+        self.duty_window = 3
 
-        #initialize dates
-        self.trimester_breaks = [datetime.date(2014, 11, 22), datetime.date(2015, 2, 28)]
-        vacation_list = ['9/5/2014-9/13/2014', '11/23/2014-11/30/2014',
-                         '12/20/2014-1/4/2015', '3/1/2015-3/14/2015']
-        dates = make_dates('8/25/2014', '5/29/2015', vacation_list)
-        #initialize duties to None
-        for date in dates:
-            self.set_on_duty(date, None)
-        head_dates_str = ['8/25/2014', '8/26/2014', '11/22/2014', '12/1/2014', '12/19/2014',
-                      '1/5/2015', '2/28/2015', '3/15/2015', '5/30/2015']
-        self.head_dates = []
-        for date in head_dates_str:
-            self.head_dates.append(datetime.datetime.strptime(date, '%m/%d/%Y').date())
+        #cached ScheduleObjective for the what-if checks (see fairness_objective)
+        self._objective = None
+        #rule -> 'hard' or 'soft' overrides of DUTY_RULES, and the compiled DutyRules (see duty_rules)
+        self.rule_levels = {}
+        self._rules = None
+
+        #name -> how many of their availability_changes repair_schedule has handled
+        self.changes_handled = {}
+
+        #instrumentation: a ScheduleStats while make_schedule is collecting, else None
+        self.stats = None
+        #event name -> callbacks (see add_hook)
+        self.hooks = {}
 
+        #term index -> {day name: name} (see assign_weekday_presets)
         self.weekday_presets = {}
-        for i in range(3):
-            self.weekday_presets[i] = {}
+        #initialize dates: an AcademicCalendar, by default the 2014-15 year
+        self.set_academic_calendar(calendar if calendar != None else default_calendar())
+
+    def __getstate__(self):
+        #for pickling (multiprocessing): the cached DutyRules and objective hold
+        #closures and are rebuilt on demand; hooks are callbacks, so they stay here
+        state = self.__dict__.copy()
+        state['_rules'] = None
+        state['_objective'] = None
+        state['hooks'] = {}
+        return state
+
+    def add_hook(self, event, callback):
+        """
+        calls callback(dorm, event, value) whenever event happens during an
+        instrumented make_schedule.  event is 'phase_start' (value is the phase
+        name), 'phase_end' (value is (phase, seconds)) or one of the
+        ScheduleStats counters (value is the increment)
+        """
+        self.hooks.setdefault(event, []).append(callback)
+
+    def remove_hook(self, event, callback):
+        self.hooks[event].remove(callback)
+
+    def _fire(self, event, value):
+        for callback in self.hooks.get(event, []):
+            callback(self, event, value)
+
+    def _count(self, counter, n = 1):
+        #no-op unless make_schedule is collecting stats
+        if self.stats != None:
+            self.stats.count(counter, n)
+            self._fire(counter, n)
+
+    def _run_phase(self, phase, method, *args):
+        if self.stats == None:
+            return method(*args)
+        self._fire('phase_start', phase)
+        start = timer()
+        try:
+            return method(*args)
+        finally:
+            seconds = timer() - start
+            self.stats.add_time(phase, seconds)
+            self._fire('phase_end', (phase, seconds))
+
+    def set_calendar(self, start_date, end_date, vacation_list = [], trimester_breaks = [], head_dates = []):
+        """
+        expects:
+            start_date and end_date are 'mm/dd/yyyy' strings or dates
+            vacation_list is a list of skip dates/ranges, as for make_dates
+            trimester_breaks are the first days of the terms after the first (any number)
+            head_dates are the dates the dorm head is always on duty
+        must be called before any faculty are added (see set_academic_calendar)
+        """
+        starts = [parse_date(start_date)] + sorted([parse_date(date) for date in trimester_breaks])
+        ends = [date - datetime.timedelta(days = 1) for date in starts[1:]] + [parse_date(end_date)]
+        self.set_academic_calendar(AcademicCalendar(zip(starts, ends), vacation_list, head_dates))
+
+    def set_academic_calendar(self, calendar):
+        """
+        expects:
+            calendar is an AcademicCalendar; each of its terms is a trimester
+            for weekday presets and defaults
+        must be called before any faculty are added
+        """
+        if self.fac_instance:
+            raise Exception('Dorm.set_calendar:  set the calendar before adding faculty')
+        self.academic_calendar = calendar
+        self.trimester_breaks = calendar.term_breaks()
+        self.head_dates = calendar.head_dates
+        for i in range(len(calendar)):
+            self.weekday_presets.setdefault(i, {})
+        #build the day lookup table once so the scheduling phases don't have to format dates
+        self.calendar = CalendarIndex(calendar.dates(), calendar.term_index, self.head_dates)
+        self._objective = None
+        self._rules = None
+        #hospital run dates set so far carry over to the new store
+        runs = [(h, date) for h, runs in [('h1', self.h1), ('h2', self.h2)] for date in runs]
+        self.assignments = AssignmentStore(self.calendar.first, len(self.calendar))
+        self.on_duty = self.assignments.view('dorm')
+        self.h1 = self.assignments.view('h1')
+        self.h2 = self.assignments.view('h2')
+        for h, date in runs:
+            self.set_hospital_run(h, date, None)
+        #initialize duties to None
+        for date in self.calendar.scheduled_dates():
+            self.set_on_duty(date, None)
 
     def set_hospital_run_dates(self, start_date, end_date):
-        new_dates = make_dates(start_date, end_date)
-        for date in new_dates:
-            self.h1[date] = None
-            self.h2[date] = None
+        self._objective = None
+        for date in iter_dates(start_date, end_date):
+            self.set_hospital_run('h1', date, None)
+            self.set_hospital_run('h2', date, None)
 
-    def set_hospital_runs(self):
+    def set_hospital_run(self, h, date, name):
+        #h is 'h1' or 'h2'; keeps the faculty duty index in step with the dict
+        runs = self.h1 if h == 'h1' else self.h2
+        old_name = runs.get(date)
+        if old_name != None and old_name != name:
+            self.fac_instance[old_name].set_off_duty(date, h)
+        if name != None:
+            self.fac_instance[name].add_duty(date, h)
+        runs[date] = name
+
+    def add_guest(self, fac):
+        """
+        lets fac, a Faculty member of another dorm, be assigned this dorm's
+        hospital runs (see campus_hospital.CampusHospitalPool); guests don't
+        join this dorm's faculty or hr_faculty lists
+        """
+        if self.fac_instance.get(fac.name, fac) is not fac:
+            raise ValueError('Dorm.add_guest:  name already used in %s' % self.name, fac.name)
+        self.fac_instance[fac.name] = fac
+        self._rules = None
+
+    def set_hospital_runs(self, method = 'rotation'):
+        #method is 'rotation' (rotating lists, then repair) or 'matching' (see match_hospital_runs)
+        if method == 'matching':
+            return self.match_hospital_runs()
+        elif method != 'rotation':
+            raise ValueError('Dorm.set_hospital_runs:  method not valid', method)
         #build rotating list of faculty, starting with non-residential faculty (sorry)
         h1_list = []
         for fac in self.hr_faculty:
@@ -150,115 +1295,127 @@ class Dorm():
                 h1_list.append(fac)
         h2_list = h1_list[:]
         max_duties = float(len(self.h1))/len(self.hr_faculty)
-        def h1_assignment_error(hardness = 'hard'):
-            if hardness == 'hard':
-                return (date in fac.unavailable_dates
-                    or dow in fac.unavailable_dow
-                    or fac.name == self.on_duty[date]
-                    or (previous_day in self.h1 and self.h1[previous_day] == fac.name)
-                    or fac.family == self.on_duty[date]
-                    or fac.family == self.h2[date]
-                )
-            else:
-                return (date in fac.unavailable_dates
-                    or dow in fac.unavailable_dow
-                    or fac.name == self.on_duty[date]
-                    or fac.family == self.on_duty[date]
-                )
-
-
-        def h2_assignment_error(hardness = 'hard'):
-            return (date in fac.unavailable_dates
-                    or dow in fac.unavailable_dow
-                    or fac.name == self.on_duty[date]
-                    or fac.name == self.h1[date]
-                    or fac.family == self.on_duty[date]
-                    or fac.family == self.h1[date]
-                )
+        rules = self.duty_rules()
 
         for date in sorted(self.h1.keys()):
-            dow = date.strftime('%A')
-            previous_day =date - datetime.timedelta(days = 1)
-            #Assign hospital run #1
-            index = 0
-            while self.h1[date] == None:
-                fac = h1_list[index]
-                if h1_assignment_error():
-                    index += 1
-                else:
-                    self.h1[date] = fac.name
-            if len(fac.get_duty_dates('h1')) >= max_duties:
-                h1_list.remove(fac)
-                h1_list.append(fac)
-            #Now assign hospital run #2
-            index = 0
-            while self.h2[date] == None:
-                fac = h2_list[index]
-                if h2_assignment_error():
-                    index += 1
-                    success = False
+            for h, rotation in [('h1', h1_list), ('h2', h2_list)]:
+                allowed = rules.predicate(h)
+                fac = None
+                for candidate in rotation:
+                    if allowed(candidate.name, date):
+                        fac = candidate
+                        break
+                if fac == None:
+                    raise InfeasibleScheduleError('no one can take %s on %s' % (h, date))
+                self.set_hospital_run(h, date, fac.name)
+                if h == 'h1':
+                    done = fac.get_duty_count('h1') >= max_duties
                 else:
-                    self.h2[date] = fac.name
-            if len(fac.get_duty_dates('h1')) + len(fac.get_duty_dates('h2')) >= 2*max_duties:
-                h2_list.remove(fac)
-                h2_list.append(fac)
-
-        # now balance
-        def calculate_overload(h):
-            share = self.calculate_shares()
-            overload = {}
-            for fac in self.hr_faculty:
-                overload[fac.name] = len(fac.get_duty_dates(h)) - max_duties
-            #sort list in order of increasing overload, see http://stackoverflow.com/questions/613183/sort-a-python-dictionary-by-value
-            overload_list = sorted(overload, key=overload.get)
-            #print [fac + ':' + str(overload[fac]) for fac in overload_list]
-            max_diff = overload[overload_list[-1]] - overload[overload_list[0]]
-            return overload_list, max_diff, overload
+                    done = fac.get_duty_count('h1') + fac.get_duty_count('h2') >= 2*max_duties
+                if done:
+                    rotation.remove(fac)
+                    rotation.append(fac)
 
+        # now balance, relaxing any soft rules
         for h in ['h1', 'h2']:
-            overload_list, max_diff, overload = calculate_overload(h)
+            runs = self._duty_dict(h)
+            allowed = rules.predicate(h, strict = False)
+            tracker = self.make_load_tracker(h)
+            max_diff = tracker.load_diff()
             iter = 0
             while max_diff > 1.:
                 iter += 1
+                self._count('hospital_repair_iterations')
                 if iter >= 100:
-                    print 'oops', h, max_diff
-                    sys.exit(-1)
-                overloaded = overload_list[-1]
+                    raise InfeasibleScheduleError('%s still unbalanced by %g after 100 moves' % (h, max_diff))
+                overloaded = tracker.most_loaded()
+                underloaded = tracker.least_loaded()
+                overload_list = None
                 underloaded_index = 0
                 index = 0
-                date = self.fac_instance[overloaded].get_duty_dates(h)[index]
-                while eval('self.' + h + '[date]') == overloaded:
-                    underloaded = overload_list[underloaded_index]
-                    #print h, overloaded, underloaded, max_diff, date, self.on_duty[date]
+                date = self.fac_instance[overloaded].get_duty_list(h)[index]
+                while runs[date] == overloaded:
+                    if underloaded_index > 0:
+                        #only rank everyone once the least loaded person has been ruled out
+                        if overload_list == None:
+                            overload_list = tracker.ranked()
+                        underloaded = overload_list[underloaded_index]
                     if underloaded == overloaded:
-                        print 'exhausted all possibilities', overloaded
-                        continue
-                    fac = self.fac_instance[underloaded]
-                    if eval(h+'_assignment_error(\'soft\')'):
+                        raise InfeasibleScheduleError('exhausted all possibilities for %s on %s' % (overloaded, h))
+                    if not allowed(underloaded, date):
                         index += 1
                         try:
-                            date = self.fac_instance[overloaded].get_duty_dates(h)[index]
-                        except:
+                            date = self.fac_instance[overloaded].get_duty_list(h)[index]
+                        except IndexError:
                             #we've tried too many dates.  go to the next underloaded person
                             underloaded_index += 1
                             index = 0
+                            date = self.fac_instance[overloaded].get_duty_list(h)[index]
                     else:
-                        if h == 'h1':
-                            self.h1[date] = underloaded
-                        else:
-                            self.h2[date] = underloaded
-                overload_list, max_diff,  overload = calculate_overload(h)
+                        self.set_hospital_run(h, date, underloaded)
+                tracker.update(overloaded, underloaded)
+                max_diff = tracker.load_diff()
         #    print h, overload_list, max_diff
         #    print [fac.name+':'+str(len(fac.get_duty_dates(h))) for fac in self.hr_faculty]
         #print 'date', 'on duty', 'h1', 'h2'
         #for date in sorted(self.h1.keys()):
         #    print date, self.on_duty[date], self.h1[date], self.h2[date]
 
+    def match_hospital_runs(self):
+        """
+        Fills the open H1 and H2 slots by min-cost matching (see match_slots)
+        instead of rotating lists.  H1 is matched first, then H2 around it.
+        Pairings that break a duty rule (see DutyRules) are left out of the
+        graph: unavailability, dorm duty (or family on duty) that day, H1 on
+        consecutive days, and H1/H2 going to the same person or family on the
+        same day.  Balance within H1 and
+        within H2 is the cost; hospital-only faculty, then adjuncts, take the
+        odd extra run.
+        raises InfeasibleScheduleError if a slot can't be filled
+        """
+        if not self.hr_faculty:
+            return
+        names = [fac.name for fac in self.hr_faculty]
+        target = float(len(self.h1))/len(self.hr_faculty)
+        shares = dict([(name, target) for name in names])
+        one_day = datetime.timedelta(days = 1)
+        rules = self.duty_rules()
+
+        #H1: the consecutive-day rule links dates, so solve, forbid the later day of
+        #each back-to-back pair, and solve again; every round removes an edge
+        open_h1 = sorted([date for date in self.h1 if self.h1[date] == None])
+        fixed = dict([(name, self.fac_instance[name].get_duty_count('h1')) for name in names])
+        forbidden = set()
+        allowed = rules.predicate('h1')
+        def h1_allowed(name, date):
+            return (name, date) not in forbidden and allowed(name, date)
+        while True:
+            assignment = match_slots(open_h1, names, h1_allowed, shares, fixed, hospital_run_bias(self.hr_faculty, 'h1'))
+            back_to_back = [date for date in open_h1
+                            if assignment.get(date - one_day) == assignment[date]]
+            if not back_to_back:
+                break
+            for date in back_to_back:
+                forbidden.add((assignment[date], date))
+        for date in open_h1:
+            self.set_hospital_run('h1', date, assignment[date])
+
+        #H2: anyone but the H1 person and their family; people with more H1 runs
+        #are last in line for the extras
+        open_h2 = sorted([date for date in self.h2 if self.h2[date] == None])
+        fixed = dict([(name, self.fac_instance[name].get_duty_count('h2')) for name in names])
+        assignment = match_slots(open_h2, names, rules.predicate('h2'), shares, fixed,
+                                 hospital_run_bias(self.hr_faculty, 'h2'))
+        for date in open_h2:
+            self.set_hospital_run('h2', date, assignment[date])
+
     def add_faculty(self, name, role = 'adjunct', load = None, family = None):
         roles = ['adjunct', 'residential', 'head', 'hospital']
         if role not in roles:
             raise Exception('Role: %s not in roles' % role)
         self.fac_instance[name] = Faculty(name, role, self, load, family)
+        self._objective = None
+        self._rules = None
 
         #put all faculty in hospital run faculty list
         self.hr_faculty.append(self.fac_instance[name])
@@ -316,13 +1473,17 @@ class Dorm():
                                     'FALSE'])
 
     def set_on_duty(self, date, name):
-        #turn off old assignments
+        old_name = self.on_duty.get(date)
         if name != None:
             #turn on new assignment in the faculty member itself
             try:
                 self.fac_instance[name].set_on_duty(date)
             except:
+                self._count('set_on_duty_failures')
                 raise Exception('date unavailable')
+        #turn off old assignments
+        if old_name != None and old_name != name:
+            self.fac_instance[old_name].set_off_duty(date)
         #turn on new assignment here
         self.on_duty[date] = name
 
@@ -337,221 +1498,629 @@ class Dorm():
             else:
                 raise ValueError('Invalid name for load: ', fac.load)
 
-        num_weekdays = 0
-        num_fridays = 0
-        num_saturdays = 0
-        for date in self.on_duty:
-            dow = date.strftime('%A')
-            if dow in weekdays:
-                num_weekdays += 1
-            elif dow == 'Friday':
-                num_fridays += 1
-            else:
-                num_saturdays += 1
-        num_days = num_weekdays + num_fridays + num_saturdays
+        totals = self.assignments.dow_totals('dorm')
+        num_fridays = totals[FRIDAY]
+        num_saturdays = totals[SATURDAY]
+        num_days = sum(totals)
+        num_weekdays = num_days - num_fridays - num_saturdays
 
         share = {}
         share['partial'] = float(num_weekdays + num_saturdays)/(num_partial + num_full)
         share['full'] = float(num_days - share['partial']*num_partial)/num_full
         return share
 
+    def make_load_tracker(self, duty_type = 'dorm'):
+        #dorm duty is shared by load (see calculate_shares); hospital runs evenly across hr_faculty
+        if duty_type == 'dorm':
+            share = self.calculate_shares()
+            shares = dict([(fac.name, share[fac.load]) for fac in self.faculty])
+            return LoadTracker(self.faculty, 'dorm', shares)
+        runs = self.h1 if duty_type == 'h1' else self.h2
+        max_duties = float(len(runs))/len(self.hr_faculty)
+        shares = dict([(fac.name, max_duties) for fac in self.hr_faculty])
+        return LoadTracker(self.hr_faculty, duty_type, shares)
+
+    def snapshot(self):
+        #copy of the assignment state, for restore()
+        return (dict(self.on_duty), dict(self.h1), dict(self.h2))
+
+    def restore(self, state):
+        """
+        puts the dorm back to a snapshot() taken from it, keeping the faculty
+        duty indexes in step; faculty and calendar are left alone
+        """
+        on_duty, h1, h2 = state
+        for date in [date for date in self.on_duty if date not in on_duty]:
+            self.set_on_duty(date, None)
+            del self.on_duty[date]
+        for date in on_duty:
+            if self.on_duty.get(date) != on_duty[date] or date not in self.on_duty:
+                self.set_on_duty(date, on_duty[date])
+        for h, runs in [('h1', h1), ('h2', h2)]:
+            current = self.h1 if h == 'h1' else self.h2
+            for date in [date for date in current if date not in runs]:
+                self.set_hospital_run(h, date, None)
+                del current[date]
+            for date in runs:
+                if current.get(date) != runs[date] or date not in current:
+                    self.set_hospital_run(h, date, runs[date])
+
     def get_adjuncts(self):
         adjuncts = [fac.name for fac in self.faculty if fac.role == 'adjunct']
         return adjuncts
 
+    def duty_statistics(self):
+        #see DutyStatistics
+        return DutyStatistics(self)
+
     def get_duty_counts(self):
-        count = {}
-        for fac in self.hr_faculty:
-            count[fac.name] = {}
-            count[fac.name]['weekdays'] = 0
-            count[fac.name]['Friday'] = 0
-            count[fac.name]['Saturday'] = 0
-            count[fac.name]['total'] = 0
-            count[fac.name]['H1'] = 0
-            count[fac.name]['H2'] = 0
-        for date in self.on_duty.keys():
-            name = self.on_duty[date]
-            count[name]['total'] += 1
-            dow = date.strftime('%A')
-            if dow in weekdays:
-                count[name]['weekdays'] += 1
-            else: #weekend
-                count[name][dow] += 1
-        print 'Name', 'total', 'Weekdays', 'Fridays', 'Saturdays', 'H1', 'H2'
-        for fac in self.faculty:
-            print fac.name, count[fac.name]['total'],  count[fac.name]['weekdays'], \
-                count[fac.name]['Friday'], count[fac.name]['Saturday'], \
-                len(fac.get_duty_dates('h1')), len(fac.get_duty_dates('h2'))
+        #prints each dorm faculty member's duty counts; returns the DutyStatistics
+        stats = self.duty_statistics()
+        print stats.report([fac.name for fac in self.faculty])
+        return stats
 
     def assign_weekday_defaults(self, weekday_presets = {}):
-        success = False
-        while not success:
-            success = True
-            default_dict = weekday_presets.copy()
-            faculty_tba = self.faculty[:]
-            for name in default_dict.values():
-                faculty_tba.remove(self.fac_instance[name])
-            for day in weekdays:
-                if day not in default_dict.keys():
-                    def_fac = random.choice(faculty_tba)
-                    faculty_tba.remove(def_fac)
-                    default_dict[day]=def_fac.name
-            for day in weekdays:
-                if day in self.fac_instance[default_dict[day]].unavailable_dow:
-                    success = False
+        """
+        picks a default person for each weekday: the presets, then a matching
+        (see match_slots) of the other days to the faculty without a preset,
+        each available on their day.  Ties are broken at random, so seeds give
+        different defaults; someone takes two days only if there is no other way.
+        returns:
+            a dict of day name -> name
+        raises InfeasibleScheduleError if a preset or day can't be covered
+        """
+        default_dict = weekday_presets.copy()
+        for day, name in default_dict.items():
+            if not self.fac_instance[name].is_available_dow(day):
+                raise InfeasibleScheduleError('%s is preset for %s but unavailable that day' % (name, day))
+        days = [day for day in weekdays if day not in default_dict]
+        if not days:
+            return default_dict
+        names = [fac.name for fac in self.faculty if fac.name not in default_dict.values()]
+        if not names:
+            raise InfeasibleScheduleError('no faculty left for %s' % ', '.join(days))
+        random.shuffle(days)
+        random.shuffle(names)
+        shares = dict([(name, float(len(days))/len(names)) for name in names])
+        bias = dict([(name, random.randrange(10)) for name in names])
+        allowed = lambda name, day: self.fac_instance[name].is_available_dow(day)
+        default_dict.update(match_slots(days, names, allowed, shares, bias = bias))
         return default_dict
 
-    def assign_weekends(self):
-        dates = sorted([date for date in self.on_duty.keys()])
-        weekend_list = {}
-        weekend_list['Friday'] = [fac.name for fac in self.faculty]
-        weekend_list['Saturday'] = [fac.name for fac in self.faculty][::-1]
+    def weekend_quotas(self):
+        """
+        returns:
+            {FRIDAY: {name: quota}, SATURDAY: {name: quota}}, how many of the
+            open Fridays and Saturdays each faculty member should take.
+            calculate_shares gives everyone the same part of each weekend day
+            (partial loads give back a weekday for each Friday), so each
+            day's fair share is its total over the faculty.  The odd extra day
+            goes to full loads first; days already held (the head dates) count
+            towards the holder's share, and any held beyond it come off the
+            others, partial loads first.
+        """
+        share = self.calculate_shares()
+        #larger shares first, then roster order
+        order = sorted(self.faculty, key = lambda fac: -share[fac.load])
+        held = dict([(dow, collections.Counter()) for dow in WEEKEND_DOWS])
+        open_days = dict([(dow, 0) for dow in WEEKEND_DOWS])
+        store = self.assignments
+        dow = (store.origin + 6) % 7
+        for id in store.column('dorm'):
+            if dow in WEEKEND_DOWS:
+                if id == NOBODY:
+                    open_days[dow] += 1
+                elif id >= 0:
+                    held[dow][store.names[id]] += 1
+            dow = dow + 1 if dow < 6 else 0
 
-        #put the head at the end of both lists so they don't get overloaded w/ preassignments
-        for fac in self.faculty:
-            if fac.role == 'head':
-                head = fac.name
-        for day in weekends:
-            weekend_list[day].remove(head)
-            weekend_list[day].append(head)
+        quotas = {}
+        for dow in WEEKEND_DOWS:
+            base, extra = divmod(open_days[dow] + sum(held[dow].values()), len(order))
+            quota = dict([(fac.name, max(base + (rank < extra) - held[dow][fac.name], 0))
+                          for rank, fac in enumerate(order)])
+            surplus = sum(quota.values()) - open_days[dow]
+            ranks = range(len(order))
+            while surplus > 0:
+                rank = max(ranks, key = lambda rank: (quota[order[rank].name], rank))
+                quota[order[rank].name] -= 1
+                surplus -= 1
+            quotas[dow] = quota
+        return quotas
 
-        for date in dates:
-            dow = date.strftime('%A')
-            if dow in weekends:
-                if self.on_duty[date] == None:
-                    success = False
-                    index = 0
-                    while not success:
-                        success = True
-                        name = weekend_list[dow][index]
-                        #make sure that no one gets friday-saturday duty
-                        if dow == 'Saturday':
-                            friday = date - datetime.timedelta(days = 1)
-                            if name == self.on_duty[friday]:
-                                index += 1
-                                name = weekend_list[dow][index]
-                        try:
-                            self.set_on_duty(date, name)
-                        except:
-                            success = False
-                            index += 1
-                name = self.on_duty[date]
-                try:
-                    weekend_list[dow].remove(name)
-                    weekend_list[dow].append(name)
-                except:
-                    print 'dow', dow
-                    print 'name=', name
-                    print 'list=', weekend_list[dow]
-                    sys.exit(-1)
-
-        #now go through weekends again and replace weekday assignments
-        partials = []
-        replacement_list = []
-        for fac in self.faculty:
-            if fac.load == 'partial':
-                partials.append(fac.name)
-            elif fac.load == 'full':
-                replacement_list.append(fac.name)
-            else:
-                raise ValueError
+    def assign_weekends(self):
+        """
+        Fills the open Fridays and Saturdays in one pass in date order.  Each
+        day goes to whoever has the most of their weekend_quotas left for
+        that day (a heap per day) among those the duty rules allow, so no one
+        gets a Friday and the following Saturday; someone over quota only
+        gets a day no one under quota can take.  Ties go to whoever had that
+        day least recently, then down the roster for Fridays and up it for
+        Saturdays, with the head last.
+        Then each partial load with a Friday hands their weekday duty earlier
+        that week to a full load, taking turns.
+        raises InfeasibleScheduleError if no one can take a day
+        """
+        allowed = self.duty_rules().predicate('dorm')
+        quotas = self.weekend_quotas()
+        names = [fac.name for fac in self.faculty if fac.role != 'head']
+        heads = [fac.name for fac in self.faculty if fac.role == 'head']
+        orders = {FRIDAY: names + heads, SATURDAY: names[::-1] + heads}
+        heaps = {}
+        for dow in WEEKEND_DOWS:
+            #(-quota left, last row given that day, tie order, name)
+            heaps[dow] = [(-quotas[dow][name], -1, i, name) for i, name in enumerate(orders[dow])]
+            heapq.heapify(heaps[dow])
 
-        for date in dates:
-            name = self.on_duty[date]
-            if date.strftime('%A') == 'Friday' and name in partials:
-                #find the person's weekday:
+        store = self.assignments
+        column = store.column('dorm')
+        origin = store.origin
+        dow = (origin + 6) % 7
+        for i in range(len(column)):
+            if column[i] == NOBODY and dow in WEEKEND_DOWS:
+                date = datetime.date.fromordinal(origin + i)
+                heap = heaps[dow]
+                skipped = []
+                while heap and not allowed(heap[0][3], date):
+                    skipped.append(heapq.heappop(heap))
+                if not heap:
+                    raise InfeasibleScheduleError('no one can take %s %s' % (DAY_NAMES[dow], date))
+                left, last, tie, name = heapq.heappop(heap)
+                self.set_on_duty(date, name)
+                heapq.heappush(heap, (left + 1, i, tie, name))
+                for entry in skipped:
+                    heapq.heappush(heap, entry)
+            dow = dow + 1 if dow < 6 else 0
+
+        #now go through the Fridays again and replace weekday assignments
+        partials = set([store.ids[fac.name] for fac in self.faculty
+                        if fac.load == 'partial' and fac.name in store.ids])
+        #(replacements so far, roster order, name)
+        replacements = [(0, i, fac.name) for i, fac in enumerate(self.faculty) if fac.load == 'full']
+        calendar = self.calendar
+        head_offset = origin - calendar.first
+        dow = (origin + 6) % 7
+        for i in range(len(column)):
+            if dow == FRIDAY and column[i] in partials:
+                #find the person's weekday: the latest duty of theirs Sunday to
+                #Thursday that isn't a head date (those stay with the head)
                 weekday_duty = None
-                for i in range(1,6):
-                    test_date = date - datetime.timedelta(days = i)
-                    if test_date in dates and self.on_duty[test_date] == name:
-                        weekday_duty = test_date
+                for j in range(i - 1, max(i - 6, -1), -1):
+                    if column[j] == column[i] and not calendar.head[j + head_offset]:
+                        weekday_duty = datetime.date.fromordinal(origin + j)
                         break
-                #assign someone from the replacement list to that duty if it exists
                 if weekday_duty != None:
-                    replacement_name = replacement_list[0]
-                    #make sure this person doesn't have the following Saturday duty
-                    saturday = date + datetime.timedelta(days = 1)
-                    if saturday in dates and replacement_name == self.on_duty[saturday]:
-                        #if they do, go to the next person
-                        replacement_name = replacement_list[1]
-                    try:
-                        set_on_duty(weekday_duty, replacement_name)
-                    except:
-                        #if that person is also not available, go to the next person.
-                        index += 1
-                        if index >= len(replacement_list):
-                            index = 0
-                        replacement_name = replacement_list[index]
-                        self.set_on_duty(weekday_duty,replacement_name)
-                    #and move the person who actually got this extra duty assigned to the end of the list
-                    replacement_list.remove(replacement_name)
-                    replacement_list.append(replacement_name)
+                    #whoever has replaced least, is available and doesn't have the following Saturday
+                    saturday = column[i + 1] if i + 1 < len(column) else ABSENT
+                    skipped = []
+                    while replacements and (store.ids.get(replacements[0][2]) == saturday
+                                            or not allowed(replacements[0][2], weekday_duty)):
+                        skipped.append(heapq.heappop(replacements))
+                    if replacements:
+                        count, tie, name = heapq.heappop(replacements)
+                        self.set_on_duty(weekday_duty, name)
+                        heapq.heappush(replacements, (count + 1, tie, name))
+                    for entry in skipped:
+                        heapq.heappush(replacements, entry)
+            dow = dow + 1 if dow < 6 else 0
 
+    def rebalance_weekdays(self, solver = 'greedy'):
+        #solver is 'greedy' (move worst days one at a time) or 'flow' (see rebalance_weekdays_flow)
+        if solver == 'flow':
+            return self.rebalance_weekdays_flow()
+        elif solver != 'greedy':
+            raise ValueError('Dorm.rebalance_weekdays:  solver not valid', solver)
+        calendar = self.calendar
+        movable_dates = [date for date in self.on_duty.keys()
+                         if not calendar.head[calendar.row(date)]
+                         and not calendar.weekend[calendar.row(date)]]
+        tracker = self.make_load_tracker('dorm')
+        allowed = self.duty_rules().predicate('dorm')
+        while tracker.load_diff() > 1.:
+            move = self._rebalance_move(tracker, movable_dates, allowed)
+            if move == None:
+                #no one can take a day from anyone more than one duty above them
+                break
+            worst_day, giver, receiver = move
+            self.set_on_duty(worst_day, receiver)
+            self._count('rebalance_moves')
+            tracker.update(giver, receiver)
 
-    def rebalance_weekdays(self):
-        weekdays = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday']
-        def calculate_overload():
-            share = self.calculate_shares()
-            overload = {}
-            for fac in self.faculty:
-                overload[fac.name] = len(fac.get_duty_dates('dorm')) - share[fac.load]
-            #sort list in order of increasing overload, see http://stackoverflow.com/questions/613183/sort-a-python-dictionary-by-value
-            overload_list = sorted(overload, key=overload.get)
-            biggest_load_diff = overload[overload_list[-1]] - overload[overload_list[0]]
-            return overload_list[-1], overload_list[0], biggest_load_diff
-        most_loaded, least_loaded, load_diff = calculate_overload()
-        while load_diff > 1.:
-            #give the lowest-load person the biggest load's worst day
-            dates = [date for date in self.on_duty.keys()
-                     if date not in self.head_dates
-                and date.strftime('%A') in weekdays]
-            success = False
-            while not success:
-                success = True
-                worst_day = self.fac_instance[most_loaded].get_worst_day(dates)
-                try:
-                    self.set_on_duty(worst_day, least_loaded)
-                except:
-                    success = False
+    def _rebalance_move(self, tracker, movable_dates, allowed):
+        #(date, giver, receiver): the lowest-load person who can take one gets the
+        #biggest load's worst day, trying the next most loaded giver if no one
+        #can; None when no move narrows a gap of more than one duty
+        ranked = tracker.ranked()
+        overload = tracker.overload
+        for giver in reversed(ranked):
+            for receiver in ranked:
+                if overload[giver] - overload[receiver] <= 1.:
+                    break
+                dates = set(movable_dates)
+                worst_day = self.fac_instance[giver].get_worst_day(dates)
+                while worst_day != None and not allowed(receiver, worst_day):
                     dates.remove(worst_day)
-            most_loaded, least_loaded, load_diff = calculate_overload()
+                    worst_day = self.fac_instance[giver].get_worst_day(dates)
+                if worst_day != None:
+                    return worst_day, giver, receiver
+        return None
+
+    def rebalance_weekdays_flow(self, cluster_cost = 10, change_cost = 1):
+        """
+        Reassigns every weekday duty that isn't a head date in one min-cost flow
+        solve.  Weekend and head duties stay put and count towards each share.
+            source -> faculty: one arc per duty, costing the increase in
+                (duties - share)**2, so the cheapest flow is the most balanced
+            faculty -> (faculty, week): one arc per duty that week, costing
+                cluster_cost for every duty the person already has that week
+            (faculty, week) -> date: when available; change_cost unless the
+                person already has the date
+            date -> sink: capacity 1
+        raises InfeasibleScheduleError if some date can't be covered
+        """
+        calendar = self.calendar
+        share = self.calculate_shares()
+        dates = sorted([date for date in self.on_duty.keys()
+                        if not calendar.head[calendar.row(date)]
+                        and not calendar.weekend[calendar.row(date)]])
+        movable = set(dates)
+        allowed = self.duty_rules().predicate('dorm')
+        #weeks run Sunday through Saturday
+        week = lambda date: date.toordinal()//7
+
+        graph = MinCostFlow()
+        source, sink = graph.add_node(), graph.add_node()
+        date_node = {}
+        for date in dates:
+            date_node[date] = graph.add_node()
+            graph.add_edge(date_node[date], sink, 1, 0)
+
+        date_edges = []
+        for fac in self.faculty:
+            fixed = 0
+            fixed_week = collections.defaultdict(int)
+            for date in fac.on_duty:
+                if date not in movable:
+                    fixed += 1
+                    fixed_week[week(date)] += 1
+            available = collections.defaultdict(list)
+            for date in dates:
+                if allowed(fac.name, date):
+                    available[week(date)].append(date)
+            fac_node = graph.add_node()
+            target = share[fac.load]
+            for k in range(1, sum([len(week_dates) for week_dates in available.values()]) + 1):
+                graph.add_edge(source, fac_node, 1, int(round(100*(2*(fixed + k - target) - 1))))
+            for w in sorted(available):
+                week_node = graph.add_node()
+                for k in range(len(available[w])):
+                    graph.add_edge(fac_node, week_node, 1, cluster_cost*(fixed_week[w] + k))
+                for date in available[w]:
+                    cost = 0 if self.on_duty[date] == fac.name else change_cost
+                    date_edges.append((graph.add_edge(week_node, date_node[date], 1, cost), date, fac.name))
+
+        flow, cost = graph.solve(source, sink, len(dates))
+        if flow < len(dates):
+            raise InfeasibleScheduleError('only %d of %d weekday dates can be covered' % (flow, len(dates)))
+        for edge, date, name in date_edges:
+            if graph.get_flow(edge) and self.on_duty[date] != name:
+                self.set_on_duty(date, name)
+                self._count('rebalance_moves')
 
     def assign_weekday_presets(self, i, weekday_presets):
         self.weekday_presets[i] = weekday_presets
 
     def assign_weekdays(self):
         #assign default weekdays
-        weekday_defaults = {}
-        for i in range(3):
-            weekday_defaults[i] = self.assign_weekday_defaults(self.weekday_presets[i])
+        weekday_defaults = [self.assign_weekday_defaults(self.weekday_presets.get(i, {}))
+                            for i in range(len(self.academic_calendar))]
 
+        calendar = self.calendar
+        allowed = self.duty_rules().predicate('dorm')
         for date in [date for date in self.on_duty.keys() if self.on_duty[date] == None and
-                date.strftime('%A') in weekdays]:
-            dow = date.strftime('%A')
-            if date < self.trimester_breaks[0]:
-                trimester = 0
-            elif date < self.trimester_breaks[1]:
-                trimester = 1
-            else:
-                trimester = 2
+                calendar.is_weekday(date)]:
+            row = calendar.row(date)
+            dow = DAY_NAMES[calendar.dow[row]]
+            trimester = calendar.trimester[row]
             name = weekday_defaults[trimester][dow]
-            success = False
-            while not success:
-                success = True
-                try:
-                    self.set_on_duty(date, name)
-                except:
-                    faculty = random.choice(self.faculty).name
-                    success = False
-
-    def make_schedule(self):
-        self.assign_weekdays()
-        self.assign_weekends()
-        self.rebalance_weekdays()
-        self.set_hospital_runs()
+            if not allowed(name, date):
+                #the default can't take it: draw someone who can
+                candidates = [fac.name for fac in self.faculty if allowed(fac.name, date)]
+                if not candidates:
+                    raise InfeasibleScheduleError('no one can take %s %s' % (dow, date))
+                name = random.choice(candidates)
+                self._count('weekday_redraws')
+            self.set_on_duty(date, name)
+
+    def can_take(self, name, type, date, leaving = None):
+        """
+        True if name could take the type ('dorm', 'h1' or 'h2') duty on date
+        as things stand, ignoring a duty of the same type they are giving up
+        on leaving.  See duty_violations.
+        """
+        return self.duty_rules().predicate(type)(name, date, leaving)
+
+    def duty_violations(self, name, type, date, leaving = None):
+        """
+        returns:
+            a list of the hard rules name would break by taking the type duty
+            on date (empty if none): availability, Friday-Saturday dorm duty,
+            dorm duty and hospital runs for the same person or family on one
+            day, and H1 on consecutive days
+        """
+        messages = {'unavailable': '%s is unavailable on %s',
+                    'family': '%s or family has %s on %s',
+                    'consecutive': '%s would have %s on %s and %s'}
+        return [messages[violation[0]] % violation[1:]
+                for violation in self._violations(name, type, date, leaving)]
+
+    def _violations(self, name, type, date, leaving):
+        #yields (rule, message arguments) lazily, so can_take stops at the first
+        for rule, detail in self.duty_rules().violations(name, type, date, leaving):
+            if rule == 'unavailable':
+                yield ('unavailable', name, date)
+            elif rule in ['same_person', 'family']:
+                yield ('family', name, detail, date)
+            else:
+                yield ('consecutive', name, type, min(detail, date), max(detail, date))
+
+    def duty_rules(self):
+        #the DutyRules for this dorm's roster and rule_levels, compiled once
+        if self._rules == None:
+            self._rules = DutyRules(self, self.rule_levels)
+        return self._rules
+
+    def set_rule_level(self, rule, level):
+        #level is 'hard' or 'soft' (see DUTY_RULES)
+        if rule not in DUTY_RULES or level not in ['hard', 'soft']:
+            raise ValueError('Dorm.set_rule_level:  not a valid rule level', rule, level)
+        self.rule_levels[rule] = level
+        self._rules = None
+
+    def fairness_objective(self):
+        #the ScheduleObjective the what-if checks report against, built once
+        if self._objective == None:
+            from schedule_optimizer import ScheduleObjective
+            self._objective = ScheduleObjective(self)
+        return self._objective
+
+    def check_changes(self, changes):
+        """
+        What-if check for reassigning several duties at once.
+        expects:
+            changes is a list of (type, date, new name), type being 'dorm',
+            'h1' or 'h2'.  Each is checked against the schedule as it would
+            be with the whole list made, so the changes are checked against
+            each other as well as the rest of the schedule.
+        returns:
+            a SwapImpact: the (type, date, old name, new name) changes, the
+            rules they break (see duty_violations; head dates stay with the
+            head), the (name, duty) -> change in counts ('Friday' and
+            'Saturday' count weekend dorm duties) and the change in the
+            fairness_objective cost.  Nothing is changed.
+        """
+        full = []
+        violations = []
+        for type, date, new in changes:
+            runs = self._duty_dict(type)
+            if date not in runs:
+                violations.append('there is no %s on %s' % (type, date))
+            elif new not in self.fac_instance:
+                violations.append('%s is not on the roster' % new)
+            else:
+                full.append((type, date, runs[date], new))
+        if len(set([(type, date) for type, date, old, new in full])) < len(full):
+            violations.append('a duty is given to more than one person')
+        #write the proposed end state into the store columns only (the
+        #Faculty duty lists are untouched), check there, then put it back
+        store = self.assignments
+        try:
+            for type, date, old, new in full:
+                store.set(type, date.toordinal(), new)
+            for type, date, old, new in full:
+                fac = self.fac_instance[new]
+                if type == 'dorm' and fac.role == 'hospital':
+                    violations.append('%s does not have dorm duty' % new)
+                if type == 'dorm' and self.calendar.is_head_date(date) and fac.role != 'head':
+                    violations.append('%s is a head date' % date)
+                violations.extend(self.duty_violations(new, type, date))
+        finally:
+            for type, date, old, new in reversed(full):
+                store.set(type, date.toordinal(), old)
+        objective = self.fairness_objective()
+        load_change = {}
+        for (name, key), change in objective.count_changes(full).items():
+            if change:
+                load_change[(name, DAY_NAMES[key] if key in WEEKEND_DOWS else key)] = change
+        return SwapImpact(full, violations, load_change, objective.delta(full))
+
+    def check_swap(self, type, date, other_date):
+        #what-if for the people holding the type duties on date and other_date trading them
+        runs = self._duty_dict(type)
+        return self.check_changes([(type, date, runs.get(other_date)), (type, other_date, runs.get(date))])
+
+    def check_reassign(self, type, date, name):
+        #what-if for giving the type duty on date to name
+        return self.check_changes([(type, date, name)])
+
+    def apply_changes(self, proposals):
+        """
+        Applies accepted what-ifs all together or not at all.
+        expects:
+            proposals is a list of change lists, as for check_changes; each is
+            checked against the schedule left by the ones before it
+        returns:
+            the total change in the fairness_objective cost
+        raises InfeasibleScheduleError (with nothing applied) if one breaks a rule
+        """
+        undo = []
+        total = 0.
+        try:
+            for changes in proposals:
+                impact = self.check_changes(changes)
+                if impact.violations:
+                    raise InfeasibleScheduleError('; '.join(impact.violations))
+                for type, date, old, new in impact.changes:
+                    undo.append((type, date, old))
+                    self._set_duty(type, date, new)
+                total += impact.cost_change
+        except:
+            for type, date, old in reversed(undo):
+                self._set_duty(type, date, old)
+            raise
+        return total
+
+    def _duty_dict(self, type):
+        return {'dorm': self.on_duty, 'h1': self.h1, 'h2': self.h2}[type]
+
+    def _set_duty(self, type, date, name):
+        if type == 'dorm':
+            self.set_on_duty(date, name)
+        else:
+            self.set_hospital_run(type, date, name)
+
+    def repair_schedule(self, window = 7):
+        """
+        Fixes a finished schedule after faculty report new unavailability
+        (Faculty.set_unavailable_* since make_schedule or the last repair).
+        Only the duties and runs people can no longer take are reassigned:
+        each goes to someone free that day who gives the original person
+        one of their own duties of the same kind within window days, so
+        everyone's counts stay the same.  When no such swap exists the
+        least loaded free person just takes it.
+        returns:
+            a list of (type, date, old name, new name) changes
+        raises InfeasibleScheduleError if no one can take a date; the
+        schedule is then left as it was, so a later call can try again
+        """
+        changes = []
+        handled = {}
+        try:
+            for name, fac in self.fac_instance.items():
+                for type, date in fac.get_lost_duties(self.changes_handled.get(name, 0)):
+                    #runs held as a guest of another dorm are that dorm's to repair
+                    if self._duty_dict(type).get(date) == name:
+                        changes.extend(self._repair_duty(type, date, name, window))
+                handled[name] = len(fac.availability_changes)
+        except:
+            for type, date, old, new in reversed(changes):
+                self._put_back(type, date, old)
+            raise
+        self.changes_handled.update(handled)
+        return changes
+
+    def _put_back(self, type, date, name):
+        #_set_duty without the availability check, to undo a repair for someone now unavailable
+        runs = self._duty_dict(type)
+        old_name = runs.get(date)
+        if old_name != None and old_name != name:
+            self.fac_instance[old_name].set_off_duty(date, type)
+        if name != None:
+            self.fac_instance[name].add_duty(date, type)
+        runs[date] = name
+
+    def _same_kind(self, type, date, other_date):
+        #swappable: hospital runs of one type, or dorm duties on the same kind of day
+        if type != 'dorm':
+            return True
+        if self.calendar.is_head_date(other_date):
+            return False
+        if date.weekday() in WEEKEND_DOWS or other_date.weekday() in WEEKEND_DOWS:
+            return date.weekday() == other_date.weekday()
+        return True
+
+    def _repair_duty(self, type, date, name, window):
+        #name still holds the duty while the candidates are found
+        pool = self.faculty if type == 'dorm' else self.hr_faculty
+        candidates = [fac for fac in pool if fac.name != name and self.can_take(fac.name, type, date)]
+        if not candidates:
+            raise InfeasibleScheduleError('no one can take %s on %s' % (type, date))
+        #nearest swap first
+        span = datetime.timedelta(days = window)
+        best = None
+        for fac in candidates:
+            dates = fac.get_duty_list(type)
+            lo = bisect.bisect_left(dates, date - span)
+            hi = bisect.bisect_right(dates, date + span)
+            for other_date in dates[lo:hi]:
+                distance = abs(other_date.toordinal() - date.toordinal())
+                if (best == None or distance < best[0]) and self._same_kind(type, date, other_date) \
+                        and self.can_take(fac.name, type, date, other_date) \
+                        and self.can_take(name, type, other_date, date):
+                    best = (distance, fac.name, other_date)
+        if best != None:
+            distance, replacement, other_date = best
+            self._set_duty(type, other_date, name)
+            self._set_duty(type, date, replacement)
+            return [(type, date, name, replacement), (type, other_date, replacement, name)]
+        if type == 'dorm':
+            share = self.calculate_shares()
+            load = lambda fac: fac.get_duty_count('dorm') - share[fac.load]
+        else:
+            load = lambda fac: fac.get_duty_count(type)
+        replacement = min(candidates, key = load).name
+        self._set_duty(type, date, replacement)
+        return [(type, date, name, replacement)]
+
+    def solve_schedule(self, max_nodes = 200000):
+        #whole-year backtracking search; see schedule_search.ScheduleSearch
+        from schedule_search import ScheduleSearch
+        return ScheduleSearch(self, max_nodes).solve()
+
+    def optimize_schedule(self, time_budget = 1.0, max_iterations = None, seed = None):
+        #simulated annealing over the finished schedule; see schedule_optimizer.ScheduleOptimizer
+        from schedule_optimizer import ScheduleOptimizer
+        optimizer = ScheduleOptimizer(self, seed = seed)
+        cost = optimizer.run(time_budget, max_iterations)
+        self._count('optimizer_moves', optimizer.accepted)
+        return cost
+
+    def make_schedule(self, weekday_solver = 'greedy', hospital_method = 'rotation', engine = 'phases',
+                      stats = False, optimize_time = None, validate = False):
+        """
+        engine is 'phases' (the steps below) or 'search' (solve_schedule)
+        hospital_method None leaves the hospital runs open (see campus_hospital)
+        optimize_time is seconds of optimize_schedule to finish with (None for none)
+        validate checks the result with schedule_validator.validate_schedule and
+        raises InfeasibleScheduleError if it breaks a hard rule
+        stats turns on instrumentation; it is also on whenever hooks are registered
+        returns:
+            a ScheduleStats of phase times and counters, or None if stats are off
+        """
+        if engine not in ['phases', 'search']:
+            raise ValueError('Dorm.make_schedule:  engine not valid', engine)
+        #a fresh schedule accounts for all availability so far
+        for name, fac in self.fac_instance.items():
+            self.changes_handled[name] = len(fac.availability_changes)
+        if stats or self.hooks:
+            self.stats = ScheduleStats()
+        try:
+            if engine == 'search':
+                nodes = self._run_phase('solve_schedule', self.solve_schedule)
+                self._count('search_nodes', nodes)
+            else:
+                self._run_phase('assign_weekdays', self.assign_weekdays)
+                self._run_phase('assign_weekends', self.assign_weekends)
+                self._run_phase('rebalance_weekdays', self.rebalance_weekdays, weekday_solver)
+                if hospital_method != None:
+                    self._run_phase('set_hospital_runs', self.set_hospital_runs, hospital_method)
+            if optimize_time:
+                self._run_phase('optimize_schedule', self.optimize_schedule, optimize_time)
+            if validate:
+                from schedule_validator import validate_schedule
+                report = self._run_phase('validate', validate_schedule, self)
+                if not report.valid():
+                    raise InfeasibleScheduleError('%s: %s' % (self.name, '; '.join(report.messages())))
+            return self.stats
+        finally:
+            self.stats = None
 
 weekdays = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday']
 weekends = ['Friday', 'Saturday']
+#day names indexed by date.weekday()
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+FRIDAY, SATURDAY = 4, 5
+WEEKEND_DOWS = (FRIDAY, SATURDAY)
 
 if __name__ == '__main__':
 #    random.seed(128)
@@ -0,0 +1,118 @@
+import heapq
+
+class MinCostFlow():
+    """
+    Min-cost flow on a directed graph by successive shortest paths (Dijkstra
+    with Johnson potentials).  Pure Python; nodes are integers handed out by
+    add_node, edges are integers handed out by add_edge.
+
+    usage:
+        graph = MinCostFlow()
+        s, t = graph.add_node(), graph.add_node()
+        e = graph.add_edge(s, t, capacity, cost)
+        flow, cost = graph.solve(s, t)
+        graph.get_flow(e)
+    """
+    def __init__(self):
+        self.adj = []
+        #edge e and its residual twin e ^ 1 are stored side by side
+        self.to = []
+        self.cap = []
+        self.cost = []
+
+    def add_node(self):
+        self.adj.append([])
+        return len(self.adj) - 1
+
+    def add_edge(self, u, v, capacity, cost):
+        e = len(self.to)
+        self.to.extend([v, u])
+        self.cap.extend([capacity, 0])
+        self.cost.extend([cost, -cost])
+        self.adj[u].append(e)
+        self.adj[v].append(e + 1)
+        return e
+
+    def get_flow(self, e):
+        return self.cap[e ^ 1]
+
+    def _initial_potential(self, source):
+        #Bellman-Ford (queue based) so negative edge costs are allowed
+        n = len(self.adj)
+        potential = [float('inf')]*n
+        potential[source] = 0
+        queue = [source]
+        in_queue = [False]*n
+        in_queue[source] = True
+        head = 0
+        while head < len(queue):
+            u = queue[head]
+            head += 1
+            in_queue[u] = False
+            for e in self.adj[u]:
+                if self.cap[e] > 0 and potential[u] + self.cost[e] < potential[self.to[e]]:
+                    v = self.to[e]
+                    potential[v] = potential[u] + self.cost[e]
+                    if not in_queue[v]:
+                        in_queue[v] = True
+                        queue.append(v)
+        return [0 if p == float('inf') else p for p in potential]
+
+    def solve(self, source, sink, max_flow = None):
+        """
+        pushes up to max_flow (default: as much as possible) from source to sink
+        returns:
+            (flow, cost) of the cheapest flow of that size
+        """
+        n = len(self.adj)
+        to, cap, cost, adj = self.to, self.cap, self.cost, self.adj
+        if min(cost[0::2] or [0]) < 0:
+            potential = self._initial_potential(source)
+        else:
+            potential = [0]*n
+        inf = float('inf')
+        total_flow = 0
+        total_cost = 0
+        while max_flow == None or total_flow < max_flow:
+            dist = [inf]*n
+            parent = [-1]*n
+            done = [False]*n
+            dist[source] = 0
+            heap = [(0, source)]
+            while heap:
+                d, u = heapq.heappop(heap)
+                if done[u]:
+                    continue
+                done[u] = True
+                if u == sink:
+                    break
+                pu = potential[u]
+                for e in adj[u]:
+                    if cap[e] > 0:
+                        v = to[e]
+                        nd = d + cost[e] + pu - potential[v]
+                        if nd < dist[v]:
+                            dist[v] = nd
+                            parent[v] = e
+                            heapq.heappush(heap, (nd, v))
+            if not done[sink]:
+                break
+            #nodes not settled before the sink get the sink's distance, which keeps reduced costs >= 0
+            limit = dist[sink]
+            for v in range(n):
+                potential[v] += dist[v] if dist[v] < limit else limit
+            push = inf if max_flow == None else max_flow - total_flow
+            v = sink
+            while v != source:
+                e = parent[v]
+                push = min(push, cap[e])
+                v = to[e ^ 1]
+            v = sink
+            while v != source:
+                e = parent[v]
+                cap[e] -= push
+                cap[e ^ 1] += push
+                total_cost += push*cost[e]
+                v = to[e ^ 1]
+            total_flow += push
+        return total_flow, total_cost
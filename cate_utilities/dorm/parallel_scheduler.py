@@ -0,0 +1,192 @@
+import collections, itertools, multiprocessing, random, sys, time, traceback, zlib, StringIO
+from dorm_cache import dorm_key
+from schedule_validator import validate_schedule
+from schedule_optimizer import ScheduleObjective
+
+#what a worker sends back for one dorm; error is None on success.  report is the
+#schedule_validator.ValidationReport of the schedule (None if none was made)
+DormResult = collections.namedtuple('DormResult', ['name', 'on_duty', 'h1', 'h2', 'counts', 'error', 'report'])
+
+def dorm_seed(seed, name):
+    #stable per-dorm seed, so results don't depend on worker count or order
+    return zlib.crc32('%s:%s' % (seed, name)) & 0xffffffff
+
+def schedule_dorm(job):
+    """
+    expects:
+        job is a (dorm, seed, export, schedule_options) tuple
+    returns:
+        a DormResult; failures (including sys.exit inside the scheduler) are
+        reported in its error field rather than raised.  Every schedule is
+        checked with validate_schedule, and one that breaks a hard rule is a
+        failure and isn't exported.
+    """
+    dorm, seed, export, schedule_options = job
+    random.seed(dorm_seed(seed, dorm.name))
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        try:
+            #validated below instead, so the report goes back with the result
+            dorm.make_schedule(**dict(schedule_options, validate = False))
+        except (Exception, SystemExit):
+            return DormResult(dorm.name, None, None, None, sys.stdout.getvalue(), traceback.format_exc(), None)
+    finally:
+        sys.stdout = stdout
+    return finish_result(dorm, export)
+
+def cached_result(dorm, export):
+    #a DormResult for a dorm whose schedule was restored from a ScheduleCache
+    return finish_result(dorm, export)
+
+def finish_result(dorm, export):
+    #validates a finished schedule, then prints the counts and exports it if it is valid
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    error = None
+    report = None
+    try:
+        try:
+            report = validate_schedule(dorm)
+            if not report.valid():
+                error = 'invalid schedule: %s' % '; '.join(report.messages())
+            dorm.get_duty_counts()
+            if export and error == None:
+                dorm.export_duty_to_csv()
+                dorm.export_hr_to_csv()
+        except (Exception, SystemExit):
+            error = traceback.format_exc()
+        counts = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    if error != None:
+        return DormResult(dorm.name, None, None, None, counts, error, report)
+    return DormResult(dorm.name, dorm.on_duty, dorm.h1, dorm.h2, counts, None, report)
+
+def apply_result(dorm, result):
+    #copy a worker's assignments back into the caller's copy of the dorm
+    for date in sorted(result.on_duty):
+        dorm.set_on_duty(date, result.on_duty[date])
+    for date in sorted(result.h1):
+        dorm.set_hospital_run('h1', date, result.h1[date])
+        dorm.set_hospital_run('h2', date, result.h2[date])
+
+def schedule_dorms(dorms, seed = 0, processes = None, export = True, cache = None, **schedule_options):
+    """
+    Schedules independent dorms in a process pool.
+    expects:
+        dorms is a list of Dorm instances with their faculty set up
+        seed is the base seed; each dorm is seeded from it and its name
+        processes is the pool size (None for one per core, 1 to run in this process)
+        cache is an optional dorm_cache.ScheduleCache; dorms whose inputs are
+            unchanged are restored from it instead of being scheduled
+        schedule_options are passed on to Dorm.make_schedule
+    returns:
+        a dict of dorm name -> DormResult.  Successful schedules (which pass
+        validate_schedule, cached ones included) are also copied into the
+        given Dorm instances.
+    """
+    by_name = {}
+    keys = {}
+    if cache != None:
+        for dorm in dorms:
+            keys[dorm.name] = dorm_key(dorm, seed, schedule_options)
+            if cache.load(keys[dorm.name], dorm):
+                by_name[dorm.name] = cached_result(dorm, export)
+        dorms = [dorm for dorm in dorms if dorm.name not in by_name]
+    jobs = [(dorm, seed, export, schedule_options) for dorm in dorms]
+    if processes == 1 or len(jobs) <= 1:
+        results = map(schedule_dorm, jobs)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(schedule_dorm, jobs, chunksize = 1)
+        finally:
+            pool.close()
+            pool.join()
+    for dorm, result in zip(dorms, results):
+        if result.error == None and result.on_duty is not dorm.on_duty:
+            apply_result(dorm, result)
+        if result.error == None and cache != None:
+            cache.store(keys[dorm.name], dorm)
+        by_name[dorm.name] = result
+    return by_name
+
+#per-process state for portfolio_search workers
+_portfolio = {}
+
+def _init_portfolio_worker(dorm, schedule_options):
+    _portfolio['dorm'] = dorm
+    _portfolio['pristine'] = dorm.snapshot()
+    _portfolio['options'] = schedule_options
+
+def _portfolio_trial(seed):
+    #reuse this process's dorm: restore the unscheduled state rather than rebuilding it
+    dorm = _portfolio['dorm']
+    dorm.restore(_portfolio['pristine'])
+    random.seed(seed)
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        try:
+            dorm.make_schedule(**_portfolio['options'])
+        except (Exception, SystemExit):
+            return seed, float('inf'), None, None
+    finally:
+        sys.stdout = stdout
+    return seed, ScheduleObjective(dorm).total_cost(), dorm.snapshot(), len(validate_schedule(dorm).violations)
+
+def portfolio_search(dorm, seeds, processes = None, target_score = None, time_budget = None,
+                     **schedule_options):
+    """
+    Runs dorm.make_schedule once per seed in worker processes and keeps the
+    fairest result (lowest schedule_optimizer.ScheduleObjective cost).
+    expects:
+        dorm is an unscheduled Dorm instance
+        seeds is a list of seeds to try
+        processes is the pool size (None for one per core, 1 to run in this process)
+        target_score stops the search once a schedule scores at or below it
+        time_budget stops the search after that many seconds
+        schedule_options are passed on to Dorm.make_schedule
+    returns:
+        (best score, best seed, number of seeds tried); the best schedule is
+        restored into dorm.  Schedules with fewer hard rule violations (see
+        schedule_validator) win whatever their score; ties go to the lower seed.
+    """
+    start = time.time()
+    best = (float('inf'), float('inf'), None, None)
+    tried = 0
+    if processes == 1:
+        pristine = dorm.snapshot()
+        _init_portfolio_worker(dorm, schedule_options)
+        trials = itertools.imap(_portfolio_trial, seeds)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes, _init_portfolio_worker, (dorm, schedule_options))
+        trials = pool.imap_unordered(_portfolio_trial, seeds)
+    try:
+        while True:
+            try:
+                if pool != None and time_budget != None:
+                    #don't wait on a worker that is stuck past the budget
+                    seed, score, state, violations = trials.next(max(time_budget - (time.time() - start), 0))
+                else:
+                    seed, score, state, violations = trials.next()
+            except (StopIteration, multiprocessing.TimeoutError):
+                break
+            tried += 1
+            if state != None and (violations, score, seed) < best[:3]:
+                best = (violations, score, seed, state)
+            if target_score != None and best[0] == 0 and best[1] <= target_score:
+                break
+            if time_budget != None and time.time() - start >= time_budget:
+                break
+    finally:
+        if pool != None:
+            pool.terminate()
+            pool.join()
+    if pool == None:
+        dorm.restore(pristine)
+    if best[3] != None:
+        dorm.restore(best[3])
+    return best[1], best[2], tried
@@ -1,4 +1,6 @@
 from dorm_scheduler import *
+from parallel_scheduler import schedule_dorms
+from dorm_cache import ScheduleCache
 T1, T2, T3 = 0, 1, 2
 
 random.seed(878)
@@ -74,8 +76,14 @@ sh.add_faculty('AGolann', 'adjunct')
 sh.add_faculty('MKrill', 'hospital')
 sh.add_faculty('EGriffin', 'hospital', family = 'FGriffin')
 
-for dorm in [chw]:
-    dorm.make_schedule()
-    dorm.get_duty_counts()
-    dorm.export_duty_to_csv()
-    dorm.export_hr_to_csv()
\ No newline at end of file
+if __name__ == '__main__':
+    #each dorm is scheduled in its own worker process, seeded from 878 and its name;
+    #dorms whose inputs haven't changed since the last run come from the cache
+    results = schedule_dorms(dorms, seed = 878, cache = ScheduleCache('schedule_cache'))
+    for dorm in dorms:
+        result = results[dorm.name]
+        print dorm.name
+        if result.error == None:
+            print result.counts
+        else:
+            print 'failed:', result.error
\ No newline at end of file
@@ -0,0 +1,249 @@
+import collections, datetime, math, random
+from timeit import default_timer as timer
+from dorm_scheduler import FRIDAY, SATURDAY
+
+#relative weight of each part of the objective
+DEFAULT_WEIGHTS = {'load': 1., 'weekend': 1., 'crowding': 1., 'hospital': 1.}
+
+class ScheduleObjective():
+    """
+    The fairness cost of a schedule (lower is better), weighted by DEFAULT_WEIGHTS:
+        load: sum of (dorm duties - share)**2
+        weekend: sum of (Fridays - fair share)**2 and (Saturdays - fair share)**2
+        crowding: pairs of one person's dorm duties within dorm.duty_window days
+        hospital: sum of (H1 runs - fair share)**2 and likewise H2
+    The shares are worked out once; counts are read from the faculty duty
+    lists, dow_counts and density, so delta() doesn't depend on the length
+    of the year.
+    """
+    def __init__(self, dorm, weights = {}):
+        self.dorm = dorm
+        self.weights = dict(DEFAULT_WEIGHTS)
+        self.weights.update(weights)
+        self.names = [fac.name for fac in dorm.faculty]
+        self.hr_names = [fac.name for fac in dorm.hr_faculty]
+        share = dorm.calculate_shares() if dorm.faculty else {}
+        self.share = dict([(fac.name, share[fac.load]) for fac in dorm.faculty])
+        totals = dorm.assignments.dow_totals('dorm')
+        self.weekend_share = dict([(dow, float(totals[dow])/max(len(self.names), 1)) for dow in (FRIDAY, SATURDAY)])
+        self.run_share = float(len(dorm.h1))/len(self.hr_names) if self.hr_names else 0.
+
+    def count(self, name, key):
+        #key is a duty type or FRIDAY/SATURDAY for weekend dorm duties
+        fac = self.dorm.fac_instance[name]
+        if key in (FRIDAY, SATURDAY):
+            return fac.dow_counts[key]
+        return len(fac.duties[key])
+
+    def term(self, name, key, count):
+        if key == 'dorm':
+            #no share (hospital faculty, guests) means no dorm duty is fair
+            return self.weights['load']*(count - self.share.get(name, 0.))**2
+        elif key in (FRIDAY, SATURDAY):
+            return self.weights['weekend']*(count - self.weekend_share[key])**2
+        return self.weights['hospital']*(count - self.run_share)**2
+
+    def window_count(self, name, date):
+        return self.dorm.fac_instance[name].density.window_count(date, self.dorm.duty_window)
+
+    def total_cost(self):
+        #the full objective, from scratch
+        cost = 0.
+        for name in self.names:
+            cost += self.term(name, 'dorm', self.count(name, 'dorm'))
+            for dow in (FRIDAY, SATURDAY):
+                cost += self.term(name, dow, self.count(name, dow))
+            pairs = 0
+            for date in self.dorm.fac_instance[name].on_duty:
+                pairs += self.window_count(name, date) - 1
+            cost += self.weights['crowding']*pairs/2
+        for name in self.hr_names:
+            for h in ['h1', 'h2']:
+                cost += self.term(name, h, self.count(name, h))
+        return cost
+
+    def count_changes(self, changes):
+        #(name, key) -> change in count, for the changes delta() takes
+        counts = collections.defaultdict(int)
+        for type, date, old, new in changes:
+            keys = [type]
+            if type == 'dorm' and date.weekday() in (FRIDAY, SATURDAY):
+                keys.append(date.weekday())
+            for key in keys:
+                if old != None:
+                    counts[(old, key)] -= 1
+                if new != None:
+                    counts[(new, key)] += 1
+        return counts
+
+    def delta(self, changes):
+        """
+        expects:
+            changes is a list of (type, date, old name, new name); each person
+            gives up and takes at most one dorm duty
+        returns:
+            the change in cost if they were made
+        """
+        delta = 0.
+        for (name, key), change in self.count_changes(changes).items():
+            if change:
+                count = self.count(name, key)
+                delta += self.term(name, key, count + change) - self.term(name, key, count)
+        given_up = {}
+        taken = {}
+        for type, date, old, new in changes:
+            if type == 'dorm':
+                given_up[old] = date
+                taken[new] = date
+        given_up.pop(None, None)
+        taken.pop(None, None)
+        #a duty's window count includes itself
+        pairs = 0
+        for name, date in given_up.items():
+            pairs -= self.window_count(name, date) - 1
+        for name, date in taken.items():
+            pairs += self.window_count(name, date)
+            if name in given_up and abs(given_up[name].toordinal() - date.toordinal()) <= self.dorm.duty_window:
+                pairs -= 1
+        return delta + self.weights['crowding']*pairs
+
+class ScheduleOptimizer():
+    """
+    Simulated annealing over a finished schedule (after Dorm.make_schedule),
+    minimising a ScheduleObjective.  Moves hand a duty to someone else, swap
+    two duties, exchange the Friday and Saturday of a weekend, or swap a
+    date's H1 and H2.  Head dates stay put and every move is checked with
+    Dorm.can_take.  A move's change in cost comes from ScheduleObjective.delta,
+    so nothing is recomputed; only accepted moves touch the dorm.
+
+    usage:
+        optimizer = ScheduleOptimizer(dorm)
+        optimizer.run(time_budget = 2.0)
+    """
+    def __init__(self, dorm, weights = {}, seed = None):
+        self.dorm = dorm
+        self.objective = ScheduleObjective(dorm, weights)
+        #follow the global seed unless given one
+        self.random = random.Random(random.getrandbits(32) if seed == None else seed)
+        calendar = dorm.calendar
+        one_day = datetime.timedelta(days = 1)
+
+        self.dates = sorted([date for date in dorm.on_duty
+                             if dorm.on_duty[date] != None and not calendar.is_head_date(date)])
+        movable = set(self.dates)
+        self.fridays = [date for date in self.dates
+                        if date.weekday() == FRIDAY and date + one_day in movable]
+        self.runs = sorted([date for date in dorm.h1 if dorm.h1[date] != None and dorm.h2[date] != None])
+        self.names = self.objective.names
+        self.hr_names = self.objective.hr_names
+
+        self.cost = self.objective.total_cost()
+        self.iterations = 0
+        self.accepted = 0
+
+    def delta(self, changes):
+        return self.objective.delta(changes)
+
+    def apply(self, changes, delta = None):
+        if delta == None:
+            delta = self.delta(changes)
+        for type, date, old, new in changes:
+            self.dorm._set_duty(type, date, new)
+        self.cost += delta
+
+    def propose(self):
+        """
+        returns:
+            a random valid list of changes, or None if the one drawn breaks a rule
+        """
+        dorm = self.dorm
+        pick = self.random.choice
+        roll = self.random.random()
+        if not self.runs:
+            roll *= 0.7
+        if roll < 0.3:
+            #hand a dorm duty to someone else
+            date = pick(self.dates)
+            old, new = dorm.on_duty[date], pick(self.names)
+            if old != new and dorm.can_take(new, 'dorm', date):
+                return [('dorm', date, old, new)]
+        elif roll < 0.6 or (roll < 0.7 and not self.fridays):
+            #swap two dorm duties
+            date, other_date = pick(self.dates), pick(self.dates)
+            return self._swap('dorm', date, other_date, dorm.on_duty)
+        elif roll < 0.7:
+            #exchange a weekend's Friday and Saturday
+            date = pick(self.fridays)
+            return self._swap('dorm', date, date + datetime.timedelta(days = 1), dorm.on_duty)
+        elif roll < 0.85:
+            #hand a hospital run to someone else
+            h = pick(['h1', 'h2'])
+            date = pick(self.runs)
+            runs = dorm.h1 if h == 'h1' else dorm.h2
+            old, new = runs[date], pick(self.hr_names)
+            if old != new and dorm.can_take(new, h, date):
+                return [(h, date, old, new)]
+        elif roll < 0.95:
+            h = pick(['h1', 'h2'])
+            return self._swap(h, pick(self.runs), pick(self.runs), dorm.h1 if h == 'h1' else dorm.h2)
+        else:
+            #swap H1 and H2 on one date; only the consecutive H1 rule can break
+            date = pick(self.runs)
+            one_day = datetime.timedelta(days = 1)
+            h1, h2 = dorm.h1[date], dorm.h2[date]
+            if dorm.h1.get(date - one_day) != h2 and dorm.h1.get(date + one_day) != h2:
+                return [('h1', date, h1, h2), ('h2', date, h2, h1)]
+        return None
+
+    def _swap(self, type, date, other_date, runs):
+        first, second = runs[date], runs[other_date]
+        if first == second or not (self.dorm.can_take(second, type, date, other_date)
+                                   and self.dorm.can_take(first, type, other_date, date)):
+            return None
+        return [(type, date, first, second), (type, other_date, second, first)]
+
+    def run(self, time_budget = 1.0, max_iterations = None, start_temperature = None, end_temperature = 0.05):
+        """
+        anneals for time_budget seconds (or max_iterations moves, for
+        repeatable results) and leaves the best schedule seen in the dorm
+        returns:
+            the final cost
+        """
+        if time_budget == None and max_iterations == None:
+            raise ValueError('ScheduleOptimizer.run:  give a time_budget or max_iterations')
+        if not self.dates:
+            return self.cost
+        if start_temperature == None:
+            #about the size of a typical uphill move
+            deltas = []
+            for i in range(200):
+                changes = self.propose()
+                if changes != None:
+                    deltas.append(abs(self.delta(changes)))
+            start_temperature = max(sum(deltas)/max(len(deltas), 1), 1.)
+        temperature = start_temperature
+        best_cost, best_state = self.cost, self.dorm.snapshot()
+        start = timer()
+        while max_iterations == None or self.iterations < max_iterations:
+            if self.iterations % 64 == 0:
+                if max_iterations != None:
+                    progress = float(self.iterations)/max_iterations
+                else:
+                    progress = (timer() - start)/time_budget
+                    if progress >= 1.:
+                        break
+                temperature = start_temperature*(end_temperature/start_temperature)**progress
+                if self.cost < best_cost - 1e-9:
+                    best_cost, best_state = self.cost, self.dorm.snapshot()
+            self.iterations += 1
+            changes = self.propose()
+            if changes == None:
+                continue
+            delta = self.delta(changes)
+            if delta <= 0 or self.random.random() < math.exp(-delta/temperature):
+                self.apply(changes, delta)
+                self.accepted += 1
+        if self.cost > best_cost + 1e-9:
+            self.dorm.restore(best_state)
+            self.cost = best_cost
+        return self.cost
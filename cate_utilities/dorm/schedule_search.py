@@ -0,0 +1,250 @@
+import collections, datetime, math, random
+from dorm_scheduler import InfeasibleScheduleError, DAY_NAMES, FRIDAY, SATURDAY, conflict_sets
+
+class ScheduleSearch():
+    """
+    Solves a dorm's whole year in one backtracking search instead of the
+    phase-by-phase generate-and-repair of Dorm.make_schedule.
+
+    Variables are the dorm duty of every non-head date plus H1 and H2 of every
+    hospital run date.  Domains start as the available faculty, and these
+    constraints are enforced by forward checking:
+        - head dates keep the head
+        - no one has dorm duty on a Friday and the following Saturday
+        - dorm duty, H1 and H2 on one date go to different people and families
+        - no one has H1 on consecutive days
+        - no one goes over their share (rounded up) of dorm duty, Fridays,
+          Saturdays, H1 or H2
+    The most constrained variable goes next; values are tried least loaded
+    first, then least crowded, with weekday presets ahead of everyone.
+
+    usage:
+        ScheduleSearch(dorm).solve()
+    """
+    def __init__(self, dorm, max_nodes = 200000):
+        self.dorm = dorm
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.vars = []
+        self.var_index = {}
+        self.domain = []
+        self.value = []
+        self.categories = []
+        self.vars_by_category = collections.defaultdict(list)
+        self.count = collections.defaultdict(int)
+        self.cap = {}
+        self.target = {}
+        self.assigned_on = collections.defaultdict(set)
+        self.trail = []
+        self._build()
+
+    def _conflicts(self, name):
+        #people who can't share a date with name: name, their family and anyone whose family they are
+        return self.conflicts.get(name, set([name]))
+
+    def _build(self):
+        dorm = self.dorm
+        calendar = dorm.calendar
+
+        self.conflicts = conflict_sets(dorm.hr_faculty)
+
+        #dorm duty
+        fixed = []
+        dorm_dates = []
+        for date in sorted(dorm.on_duty):
+            if calendar.is_head_date(date) and dorm.on_duty[date] != None:
+                fixed.append((date, dorm.on_duty[date]))
+            else:
+                dorm_dates.append(date)
+        for date in dorm_dates:
+            self._add_var('dorm', date, [fac.name for fac in dorm.faculty if fac.is_available(date)])
+        for type in ['h1', 'h2']:
+            runs = dorm.h1 if type == 'h1' else dorm.h2
+            for date in sorted(runs):
+                self._add_var(type, date, [fac.name for fac in dorm.hr_faculty if fac.is_available(date)])
+
+        #caps: each person's share rounded up, counting the fixed head dates
+        for date, name in fixed:
+            for category in self._dorm_categories(date):
+                self.count[(name, category)] += 1
+            self.assigned_on[name].add(date.toordinal())
+        share = dorm.calculate_shares() if dorm.faculty else {}
+        names = [fac.name for fac in dorm.faculty]
+        for fac in dorm.faculty:
+            self.target[(fac.name, 'dorm')] = share[fac.load]
+            self._set_cap(fac.name, ('dorm', 'total'), share[fac.load])
+        for day in ['Friday', 'Saturday']:
+            total = len(self.vars_by_category[('dorm', day)]) + \
+                sum([self.count[(name, ('dorm', day))] for name in names])
+            for name in names:
+                self._set_cap(name, ('dorm', day), float(total)/len(names))
+        for type in ['h1', 'h2']:
+            runs = dorm.h1 if type == 'h1' else dorm.h2
+            for fac in dorm.hr_faculty:
+                target = float(len(runs))/len(dorm.hr_faculty)
+                self.target[(fac.name, type)] = target
+                self._set_cap(fac.name, (type, 'total'), target)
+        #make sure the caps leave room for every variable
+        for category, vars in self.vars_by_category.items():
+            people = [name for (name, cat) in self.cap if cat == category]
+            while people and sum([self.cap[(name, category)] - self.count[(name, category)]
+                                  for name in people]) < len(vars):
+                for name in people:
+                    self.cap[(name, category)] += 1
+
+        for date, name in fixed:
+            if not self._propagate(('dorm', date), name):
+                raise InfeasibleScheduleError('the head dates leave %s with no one available' % date)
+
+    def _dorm_categories(self, date):
+        dow = self.dorm.calendar.day_of_week(date)
+        if dow in (FRIDAY, SATURDAY):
+            return [('dorm', 'total'), ('dorm', DAY_NAMES[dow])]
+        return [('dorm', 'total')]
+
+    def _add_var(self, type, date, domain):
+        v = len(self.vars)
+        self.vars.append((type, date))
+        self.var_index[(type, date)] = v
+        self.domain.append(set(domain))
+        self.value.append(None)
+        if type == 'dorm':
+            categories = self._dorm_categories(date)
+        else:
+            categories = [(type, 'total')]
+        self.categories.append(categories)
+        for category in categories:
+            self.vars_by_category[category].append(v)
+
+    def _set_cap(self, name, category, share):
+        self.cap[(name, category)] = max(int(math.ceil(share - 1e-9)), self.count[(name, category)])
+
+    def _remove(self, v, name):
+        #returns False when the domain of an open variable is wiped out
+        if self.value[v] != None or name not in self.domain[v]:
+            return True
+        self.domain[v].remove(name)
+        self.trail.append(('remove', v, name))
+        return len(self.domain[v]) > 0
+
+    def _remove_at(self, type, date, names):
+        v = self.var_index.get((type, date))
+        if v == None:
+            return True
+        for name in names:
+            if not self._remove(v, name):
+                return False
+        return True
+
+    def _propagate(self, key, name):
+        type, date = key
+        one_day = datetime.timedelta(days = 1)
+        conflicts = self._conflicts(name)
+        if type == 'dorm':
+            dow = self.dorm.calendar.day_of_week(date)
+            ok = self._remove_at('h1', date, conflicts) and self._remove_at('h2', date, conflicts)
+            if ok and dow == FRIDAY:
+                ok = self._remove_at('dorm', date + one_day, [name])
+            elif ok and dow == SATURDAY:
+                ok = self._remove_at('dorm', date - one_day, [name])
+            return ok
+        other = 'h2' if type == 'h1' else 'h1'
+        ok = self._remove_at('dorm', date, conflicts) and self._remove_at(other, date, conflicts)
+        if ok and type == 'h1':
+            ok = self._remove_at('h1', date - one_day, [name]) and self._remove_at('h1', date + one_day, [name])
+        return ok
+
+    def _assign(self, v, name):
+        self.value[v] = name
+        self.trail.append(('assign', v, name))
+        type, date = self.vars[v]
+        self.assigned_on[name].add(date.toordinal())
+        for category in self.categories[v]:
+            self.count[(name, category)] += 1
+        if not self._propagate(self.vars[v], name):
+            return False
+        for category in self.categories[v]:
+            if self.count[(name, category)] >= self.cap[(name, category)]:
+                for u in self.vars_by_category[category]:
+                    if not self._remove(u, name):
+                        return False
+        return True
+
+    def _undo(self, mark):
+        trail = self.trail
+        while len(trail) > mark:
+            action, v, name = trail.pop()
+            if action == 'remove':
+                self.domain[v].add(name)
+            else:
+                self.value[v] = None
+                self.assigned_on[name].discard(self.vars[v][1].toordinal())
+                for category in self.categories[v]:
+                    self.count[(name, category)] -= 1
+
+    def _select(self):
+        #most constrained open variable (smallest domain), earliest on ties
+        best = None
+        best_size = None
+        for v in range(len(self.vars)):
+            if self.value[v] == None:
+                size = len(self.domain[v])
+                if best == None or size < best_size:
+                    best, best_size = v, size
+                    if size <= 1:
+                        break
+        return best
+
+    def _order(self, v):
+        type, date = self.vars[v]
+        preset = None
+        calendar = self.dorm.calendar
+        if type == 'dorm' and not calendar.is_weekend(date):
+            presets = self.dorm.weekday_presets.get(calendar.get_trimester(date), {})
+            preset = presets.get(calendar.day_name(date))
+        window = self.dorm.duty_window
+        ordinal = date.toordinal()
+        def key(name):
+            crowding = 0
+            for test in range(ordinal - window, ordinal + window + 1):
+                if test in self.assigned_on[name]:
+                    crowding += 1
+            load = self.count[(name, (type, 'total'))]/max(self.target[(name, type)], 1e-9)
+            return (name != preset, load, crowding, random.random())
+        return sorted(self.domain[v], key = key)
+
+    def solve(self):
+        """
+        runs the search and writes the result into the dorm
+        raises InfeasibleScheduleError when there is no solution or max_nodes is hit
+        """
+        v = self._select()
+        stack = []
+        if v != None:
+            stack.append([v, self._order(v), 0, len(self.trail)])
+        while stack:
+            frame = stack[-1]
+            self._undo(frame[3])
+            if frame[2] >= len(frame[1]):
+                stack.pop()
+                continue
+            name = frame[1][frame[2]]
+            frame[2] += 1
+            self.nodes += 1
+            if self.nodes > self.max_nodes:
+                raise InfeasibleScheduleError('no schedule found within %d search nodes' % self.max_nodes)
+            if not self._assign(frame[0], name):
+                continue
+            v = self._select()
+            if v == None:
+                break
+            stack.append([v, self._order(v), 0, len(self.trail)])
+        else:
+            if v != None:
+                raise InfeasibleScheduleError('no schedule satisfies the constraints')
+        for v, (type, date) in enumerate(self.vars):
+            if type == 'dorm':
+                self.dorm.set_on_duty(date, self.value[v])
+            else:
+                self.dorm.set_hospital_run(type, date, self.value[v])
+        return self.nodes
@@ -0,0 +1,152 @@
+import collections, datetime
+from dorm_scheduler import ABSENT, NOBODY, SATURDAY, DutyStatistics
+
+#one broken hard rule; names are the people involved (empty for an open duty)
+Violation = collections.namedtuple('Violation', ['rule', 'type', 'date', 'names'])
+
+MESSAGES = {'unassigned': '%(type)s on %(date)s is unassigned',
+            'unknown': '%(names)s on %(type)s %(date)s is not on the roster',
+            'unavailable': '%(names)s has %(type)s on %(date)s while unavailable',
+            'friday_saturday': '%(names)s has dorm duty on Friday and Saturday %(date)s',
+            'self': '%(names)s has two duties on %(date)s',
+            'family': '%(names)s are family and both on duty %(date)s',
+            'consecutive_h1': '%(names)s has H1 on consecutive days up to %(date)s',
+            'head_date': '%(names)s has head date %(date)s'}
+
+class ValidationReport():
+    """
+    What validate_schedule found.  self.violations is a list of Violations
+    of the hard rules (valid() when it's empty); self.soft holds the fairness
+    metrics:
+        max_deviation: largest |dorm duties - share|
+        load_deviation: sum of (dorm duties - share)**2
+        crowded_pairs: pairs of one person's dorm duties within dorm.duty_window days
+        max_consecutive: longest run of one person's dorm duties on consecutive days
+        h1_spread, h2_spread: most - fewest runs across hr_faculty
+    """
+    def __init__(self, dorm_name, violations, soft):
+        self.dorm_name = dorm_name
+        self.violations = violations
+        self.soft = soft
+
+    def valid(self):
+        return not self.violations
+
+    def counts(self):
+        #rule -> number of violations
+        counts = collections.defaultdict(int)
+        for violation in self.violations:
+            counts[violation.rule] += 1
+        return dict(counts)
+
+    def messages(self):
+        return [MESSAGES[violation.rule] % {'type': violation.type, 'date': violation.date,
+                                            'names': ' and '.join(violation.names)}
+                for violation in self.violations]
+
+    def as_dict(self):
+        #plain values, for json
+        return {'dorm': self.dorm_name, 'valid': self.valid(), 'counts': self.counts(),
+                'violations': self.messages(), 'soft': dict(self.soft)}
+
+    def report(self):
+        lines = ['%s: %s' % (self.dorm_name, 'valid' if self.valid() else '%d violations' % len(self.violations))]
+        lines += ['  ' + message for message in self.messages()]
+        lines += ['  %-16s %s' % (metric, self.soft[metric]) for metric in sorted(self.soft)]
+        return '\n'.join(lines)
+
+def validate_schedule(dorm):
+    """
+    Checks a finished dorm schedule in one pass over its AssignmentStore
+    columns, so it costs O(days + faculty).  The hard rules are the ones
+    Dorm.duty_violations applies to single moves, plus head dates and open
+    duties:
+        - every dorm duty and hospital run is assigned to someone on the roster
+        - no one is on duty while unavailable
+        - no one has dorm duty on a Friday and the following Saturday
+        - no one, and no two of a family, hold two of a date's dorm duty, H1 and H2
+        - no one has H1 on consecutive days
+        - head dates go to the head
+    A Friday-Saturday pair of head dates is allowed.
+    returns:
+        a ValidationReport
+    """
+    store = dorm.assignments
+    calendar = dorm.calendar
+    names = store.names
+    #per id: Faculty (None if not on the roster), family name and whether they are the head
+    facs = [dorm.fac_instance.get(name) for name in names]
+    family = [fac.family if fac != None else None for fac in facs]
+    is_head = [fac != None and fac.role == 'head' for fac in facs]
+    columns = [('dorm', store.column('dorm')), ('h1', store.column('h1')), ('h2', store.column('h2'))]
+    dorm_column = store.column('dorm')
+    h1_column = store.column('h1')
+    window = dorm.duty_window
+
+    violations = []
+    def add(rule, type, ordinal, ids):
+        names_involved = tuple([names[id] for id in ids])
+        violations.append(Violation(rule, type, datetime.date.fromordinal(ordinal), names_involved))
+
+    #recent dorm duty indexes of each id, for crowding and streaks
+    recent = [collections.deque() for name in names]
+    streak = [0]*len(names)
+    crowded_pairs = 0
+    max_consecutive = 0
+    origin = store.origin
+    head_offset = origin - calendar.first
+    dow = (origin + 6) % 7
+    for i in range(len(dorm_column)):
+        ordinal = origin + i
+        on_day = []
+        for type, column in columns:
+            id = column[i]
+            if id == ABSENT:
+                continue
+            if id == NOBODY:
+                add('unassigned', type, ordinal, [])
+                continue
+            fac = facs[id]
+            if fac == None:
+                add('unknown', type, ordinal, [id])
+                continue
+            if not fac.availability.is_available(ordinal, dow):
+                add('unavailable', type, ordinal, [id])
+            for other in on_day:
+                if other == id:
+                    add('self', type, ordinal, [id])
+                elif family[id] == names[other] or family[other] == names[id]:
+                    add('family', type, ordinal, [other, id])
+            on_day.append(id)
+
+        id = dorm_column[i]
+        if id >= 0:
+            row = i + head_offset
+            head_date = 0 <= row < len(calendar) and calendar.head[row]
+            if head_date and not is_head[id]:
+                add('head_date', 'dorm', ordinal, [id])
+            if dow == SATURDAY and i > 0 and dorm_column[i - 1] == id:
+                if not (head_date and calendar.head[row - 1]):
+                    add('friday_saturday', 'dorm', ordinal, [id])
+            days = recent[id]
+            while days and i - days[0] > window:
+                days.popleft()
+            crowded_pairs += len(days)
+            streak[id] = streak[id] + 1 if days and days[-1] == i - 1 else 1
+            max_consecutive = max(max_consecutive, streak[id])
+            days.append(i)
+        id = h1_column[i]
+        if id >= 0 and i > 0 and h1_column[i - 1] == id:
+            add('consecutive_h1', 'h1', ordinal, [id])
+        dow = dow + 1 if dow < 6 else 0
+
+    stats = DutyStatistics(dorm)
+    deviations = [record['deviation'] for record in stats.faculty.values() if record['deviation'] != None]
+    soft = {'max_deviation': max([abs(deviation) for deviation in deviations]) if deviations else 0.,
+            'load_deviation': sum([deviation**2 for deviation in deviations]),
+            'crowded_pairs': crowded_pairs,
+            'max_consecutive': max_consecutive}
+    for h in ['H1', 'H2']:
+        runs = [record[h] for record in stats.faculty.values()]
+        soft[h.lower() + '_spread'] = max(runs) - min(runs) if runs else 0
+    return ValidationReport(dorm.name, violations, soft)
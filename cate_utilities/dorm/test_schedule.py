@@ -0,0 +1,26 @@
+import random, unittest
+from dorm_scheduler import Dorm
+from schedule_validator import validate_schedule
+
+class PartialHeadTest(unittest.TestCase):
+    #a head with a partial load keeps their head dates when assign_weekends
+    #hands partial loads' weekday duties to full loads
+
+    def make_dorm(self):
+        dorm = Dorm('LH')
+        dorm.add_faculty('A', 'residential')
+        dorm.add_faculty('B', 'residential')
+        dorm.add_faculty('C', 'adjunct')
+        dorm.add_faculty('H', 'head', 'partial')
+        return dorm
+
+    def test_head_dates_stay_with_head(self):
+        for seed in range(40):
+            dorm = self.make_dorm()
+            random.seed(seed)
+            dorm.make_schedule()
+            report = validate_schedule(dorm)
+            self.assertFalse('head_date' in report.counts(), (seed, report.messages()))
+
+if __name__ == '__main__':
+    unittest.main()
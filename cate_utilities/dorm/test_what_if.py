@@ -0,0 +1,67 @@
+import datetime, random, unittest
+from dorm_scheduler import Dorm, FRIDAY, InfeasibleScheduleError
+
+def make_dorm():
+    dorm = Dorm('CHW')
+    dorm.add_faculty('TSmith', 'adjunct')
+    dorm.add_faculty('JCaditz', 'head', family = 'AFortner')
+    dorm.add_faculty('JKellogg', 'residential')
+    dorm.add_faculty('IBarry', 'residential', family = 'RBarry')
+    dorm.add_faculty('PDenison', 'adjunct')
+    dorm.add_faculty('RBarry', 'hospital', family = 'IBarry')
+    dorm.add_faculty('AFortner', 'hospital', family = 'JCaditz')
+    dorm.set_hospital_run_dates('1/5/2015', '2/7/2015')
+    random.seed(878)
+    dorm.make_schedule()
+    return dorm
+
+class BatchedChangesTest(unittest.TestCase):
+    #changes in one check_changes list must be checked against each other
+
+    def setUp(self):
+        self.dorm = make_dorm()
+
+    def assertRejected(self, changes):
+        snapshot = self.dorm.snapshot()
+        self.assertTrue(self.dorm.check_changes(changes).violations)
+        self.assertRaises(InfeasibleScheduleError, self.dorm.apply_changes, [changes])
+        self.assertEqual(self.dorm.snapshot(), snapshot)
+
+    def test_friday_and_saturday(self):
+        dorm = self.dorm
+        one_day = datetime.timedelta(days = 1)
+        for friday in sorted(dorm.on_duty):
+            saturday = friday + one_day
+            if friday.weekday() != FRIDAY or saturday not in dorm.on_duty \
+                    or dorm.calendar.is_head_date(friday) or dorm.calendar.is_head_date(saturday):
+                continue
+            for fac in dorm.faculty:
+                changes = [('dorm', friday, fac.name), ('dorm', saturday, fac.name)]
+                if fac.role != 'head' and not dorm.check_reassign(*changes[0]).violations \
+                        and not dorm.check_reassign(*changes[1]).violations:
+                    self.assertRejected(changes)
+                    return
+        self.fail('no Friday and Saturday each allowed on their own')
+
+    def test_h1_and_h2_same_day(self):
+        dorm = self.dorm
+        for date in sorted(dorm.h1):
+            if date not in dorm.h2:
+                continue
+            for fac in dorm.hr_faculty:
+                changes = [('h1', date, fac.name), ('h2', date, fac.name)]
+                if not dorm.check_reassign(*changes[0]).violations \
+                        and not dorm.check_reassign(*changes[1]).violations:
+                    self.assertRejected(changes)
+                    return
+        self.fail('no H1 and H2 each allowed on their own')
+
+    def test_hospital_faculty_on_dorm_duty(self):
+        dorm = self.dorm
+        date = sorted(dorm.on_duty)[10]
+        impact = dorm.check_reassign('dorm', date, 'RBarry')
+        self.assertTrue('RBarry does not have dorm duty' in impact.violations)
+        self.assertRejected([('dorm', date, 'RBarry')])
+
+if __name__ == '__main__':
+    unittest.main()